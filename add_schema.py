@@ -0,0 +1,163 @@
+"""
+命令行批处理入口，不依赖 tkinter，可在构建服务器或流水线中使用：
+
+    python -m add_schema -s schema1 -s schema2 migrations/*.sql
+    python -m add_schema -c path/to/schemas.conf a.sql b.sql
+    python -m add_schema -s schema1 -j 0 big_release.sql   # 使用全部 CPU 核心并行解析
+    python -m add_schema -s s1 -s s2 --per-schema a.sql   # 输出 a_s1.sql、a_s2.sql
+    python -m add_schema -s schema1 -P 0 releases/v2.3/    # 目录下所有 .sql 文件，按文件分给全部 CPU 核心
+    python -m add_schema --profile 20 big_release.sql      # 只做剖析，列出最慢的 20 条语句
+"""
+import argparse
+import contextlib
+import sys
+import time
+
+import dfa_cache
+from batch import process_files, resolve_inputs, summarize
+from parse_cache import DEFAULT_MAX_ENTRIES, default_cache_path
+from parse_profiler import format_profile_report, profile_statements
+from sql_utils import collect_phase_timings, dfa_size, enable_parse_cache, get_parse_stats, set_dfa_limits
+from sql_generator import (
+    DEFAULT_SCHEMAS_CONF,
+    ON_ERROR_POLICIES,
+    read_schemas_file,
+    resolve_workers,
+)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="add_schema",
+        description="为 SQL 文件中的表名添加 schema 前缀，输出 <stem>_generated.sql。",
+    )
+    parser.add_argument("inputs", nargs="+", metavar="INPUT",
+                        help="SQL 文件路径、目录（递归处理其中的 .sql 文件）或 glob 模式（如 'sql/**/*.sql'）")
+    parser.add_argument("-s", "--schema", action="append", default=[], dest="schemas", metavar="SCHEMA",
+                        help="要添加的 schema，可重复指定或用逗号分隔")
+    parser.add_argument("-c", "--schemas-file",
+                        help=f"schema 配置文件，每行一个；未指定 -s/-c 时读取 {DEFAULT_SCHEMAS_CONF}")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="并行解析语句的进程数，0 表示使用全部 CPU 核心（默认 1）")
+    parser.add_argument("-P", "--file-jobs", type=int, default=1,
+                        help="按文件并行处理的进程数，适合目录中有大量文件的情况；0 表示使用全部 CPU 核心（默认 1）。"
+                             "大于 1 时文件按大小从大到小分配，每个文件内部不再并行，忽略 -j")
+    parser.add_argument("--on-error", choices=ON_ERROR_POLICIES, default="recover",
+                        help="语句存在语法错误时的处理方式：recover 由解析器恢复后继续改写（默认）；"
+                             "skip 跳过该语句；passthrough 原样输出该语句；abort 不生成该文件的输出。"
+                             "后三种在遇到第一个语法错误时立即停止解析该语句并报告位置")
+    parser.add_argument("--whole-file", action="store_true",
+                        help="整文件模式：不切分语句，整个文件一次解析，输出保留原有格式和语句之间的注释；"
+                             "忽略 -j，--on-error 只支持 recover 和 abort")
+    parser.add_argument("--per-schema", action="store_true",
+                        help="每个 schema 输出单独的文件 <stem>_<schema>.sql，源文件只解析一次，各文件在线程池中并行写出")
+    parser.add_argument("--cache", action="store_true",
+                        help=f"启用持久化解析缓存，重复处理相同语句时跳过解析（默认位置 {default_cache_path()}）")
+    parser.add_argument("--cache-path", help="持久化解析缓存文件路径，指定后自动启用缓存")
+    parser.add_argument("--cache-max-entries", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f"持久化解析缓存最多保留的语句数，超出后按最近使用时间淘汰（默认 {DEFAULT_MAX_ENTRIES}）")
+    parser.add_argument("--warm-dfa", action="store_true",
+                        help="启动时加载上次保存的解析器 DFA 快照（没有时用内置语料预热），结束后保存，"
+                             "避免每次运行都从冷启动开始构建 DFA")
+    parser.add_argument("--dfa-path", help="DFA 快照文件路径，指定后自动启用 --warm-dfa")
+    parser.add_argument("--dfa-max-states", type=int, metavar="N",
+                        help="语法 DFA 状态数超过 N 时清空 DFA 和预测上下文缓存，限制长时间运行的内存占用")
+    parser.add_argument("--dfa-reset-every", type=int, metavar="N",
+                        help="每完整解析 N 条语句清空一次 DFA 和预测上下文缓存")
+    parser.add_argument("--timings", action="store_true",
+                        help="结束后向 stderr 输出各阶段（切分、词法、语法分析、拼接等）累计耗时；"
+                             "-j 大于 1 时子进程中的分析耗时不计入")
+    parser.add_argument("--profile", type=int, metavar="N",
+                        help="剖析模式：不生成文件，逐条重新解析（不使用缓存）并列出最慢的 N 条语句及其行号、"
+                             "LL 回退和歧义次数")
+    return parser
+
+
+def resolve_schemas(args) -> list[str]:
+    schemas = [schema.strip() for value in args.schemas for schema in value.split(",") if schema.strip()]
+    if args.schemas_file:
+        schemas.extend(read_schemas_file(args.schemas_file))
+    elif not schemas:
+        schemas = read_schemas_file(DEFAULT_SCHEMAS_CONF)
+    return schemas
+
+
+def profile_inputs(parser, args) -> int:
+    inputs = resolve_inputs(args.inputs)
+    if not inputs:
+        parser.error("没有匹配的 SQL 文件")
+
+    failed = 0
+    for input_path in inputs:
+        try:
+            with open(input_path, "r", encoding="utf-8-sig") as f:
+                profiles = profile_statements(f)
+        except (OSError, UnicodeDecodeError) as e:
+            failed += 1
+            print(f"{input_path}: 处理失败: {e}", file=sys.stderr)
+            continue
+        print(format_profile_report(profiles, args.profile, input_path))
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+
+    if args.profile is not None:
+        return profile_inputs(parser, args)
+
+    try:
+        schemas = resolve_schemas(args)
+    except OSError as e:
+        parser.error(f"无法读取 schema 配置文件: {e}")
+    if not schemas:
+        parser.error("请至少指定一个 schema")
+
+    skipped = []
+    inputs = resolve_inputs(args.inputs, schemas if args.per_schema else (), skipped)
+    for path, source in skipped:
+        print(f"{path}: 已跳过（视为 {source} 生成的文件）", file=sys.stderr)
+    if not inputs:
+        parser.error("没有匹配的 SQL 文件")
+    if args.whole_file and args.on_error not in ("recover", "abort"):
+        parser.error("--whole-file 只支持 --on-error recover 或 abort")
+
+    if args.cache or args.cache_path:
+        enable_parse_cache(args.cache_path, args.cache_max_entries)
+
+    set_dfa_limits(args.dfa_max_states, args.dfa_reset_every)
+    warm = args.warm_dfa or args.dfa_path
+    if warm:
+        dfa_cache.warm_dfa(args.dfa_path)
+        warm_size = dfa_size()
+
+    processes = resolve_workers(args.file_jobs) if len(inputs) > 1 else 1
+    started = time.perf_counter()
+    results = []
+    with collect_phase_timings() if args.timings else contextlib.nullcontext() as timings:
+        for result in process_files(inputs, schemas, processes, on_error=args.on_error, whole_file=args.whole_file,
+                                    per_schema=args.per_schema, workers=resolve_workers(args.jobs)):
+            results.append(result)
+            if result.failure is not None:
+                print(f"{result.input_path}: 处理失败: {result.failure}", file=sys.stderr)
+                continue
+            for error in result.errors:
+                action = "已跳过" if args.on_error == "skip" else "已原样输出"
+                print(f"{result.input_path}: {error}（{action}）", file=sys.stderr)
+            print(f"{result.input_path} -> {', '.join(result.outputs)}")
+    summary = summarize(results, time.perf_counter() - started)
+    if len(inputs) > 1:
+        print(summary)
+    if warm and dfa_size().parser_states > warm_size.parser_states:
+        # 本次运行新增了 DFA 状态，保存下来供下次使用；清空过的 DFA 比快照小，不覆盖快照
+        dfa_cache.save_dfa(args.dfa_path)
+    if timings is not None:
+        print(timings.summary(), file=sys.stderr)
+        print(dfa_size(), file=sys.stderr)
+        print(get_parse_stats(), file=sys.stderr)
+    return 1 if summary.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+目录 / glob 批处理：每个文件在一个进程中完成切分、解析和写出，多个文件交给进程池并行处理。
+文件按大小从大到小提交，避免最大的文件最后才开始、拖长总耗时；同时在途的文件数有上限。
+全部处理完后汇总文件数、语句数、字节数和耗时。
+"""
+import glob
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import NamedTuple
+
+from sql_generator import check_cancelled, generate_schema_files, generate_sql_file, worker_pool
+from sql_utils import SqlSyntaxError, get_parse_stats
+
+# 每个进程最多排队的文件数
+_FILES_PER_WORKER = 2
+
+
+def resolve_inputs(patterns, schemas=(), skipped: list = None) -> list[str]:
+    """
+    展开 glob 模式和目录（递归查找其中的 *.sql）并去重，保持命令行中的顺序；其余路径原样保留，由后续读取时报错。
+    glob 和目录的匹配结果中会跳过本工具此前生成的文件：*_generated.sql，以及传入 schemas 时（--per-schema）
+    的 X_<schema>.sql——后者只在 X.sql 同样被匹配到时才跳过，以免误跳过恰好以 _<schema> 结尾的源文件。
+    被跳过的文件以 (路径, 对应的源文件) 追加到 skipped 中。
+    """
+    candidates = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(glob.escape(pattern), "**", "*.sql")
+        if glob.has_magic(pattern):
+            candidates.extend((path, True) for path in sorted(glob.glob(pattern, recursive=True))
+                              if os.path.isfile(path))
+        else:
+            candidates.append((pattern, False))
+
+    matched = {path for path, _ in candidates}
+    paths = []
+    seen = set()
+    for path, from_glob in candidates:
+        if path in seen:
+            continue
+        seen.add(path)
+        source = _generated_from(path, schemas, matched) if from_glob else None
+        if source is not None:
+            if skipped is not None:
+                skipped.append((path, source))
+            continue
+        paths.append(path)
+    return paths
+
+
+def _generated_from(path: str, schemas, matched) -> str | None:
+    if path.endswith("_generated.sql"):
+        return path[:-len("_generated.sql")] + ".sql"
+    for schema in schemas:
+        suffix = f"_{schema}.sql"
+        if path.endswith(suffix) and path[:-len(suffix)] + ".sql" in matched:
+            return path[:-len(suffix)] + ".sql"
+    return None
+
+
+class FileResult(NamedTuple):
+    input_path: str
+    outputs: tuple[str, ...]
+    statements: int
+    bytes: int
+    seconds: float
+    # on_error 为 skip / passthrough 时被跳过或原样输出的语句的错误
+    errors: tuple[SqlSyntaxError, ...]
+    # 处理失败的原因，成功时为 None
+    failure: str | None
+
+
+class BatchSummary(NamedTuple):
+    files: int
+    failed: int
+    statements: int
+    bytes: int
+    seconds: float
+
+    def __str__(self):
+        rate = self.bytes / 1e6 / self.seconds if self.seconds else 0.0
+        failed = f"（失败 {self.failed} 个）" if self.failed else ""
+        return (f"共处理 {self.files} 个文件{failed}，{self.statements} 条语句，"
+                f"{self.bytes / 1e6:.2f} MB，用时 {self.seconds:.1f} 秒（{rate:.2f} MB/秒）")
+
+
+def summarize(results, seconds: float) -> BatchSummary:
+    """
+    seconds 为整个批处理的实际耗时，而不是各文件耗时之和。
+    """
+    results = list(results)
+    return BatchSummary(
+        files=len(results),
+        failed=sum(1 for result in results if result.failure is not None),
+        statements=sum(result.statements for result in results),
+        bytes=sum(result.bytes for result in results),
+        seconds=seconds,
+    )
+
+
+def process_file(input_path: str, schemas, on_error: str = "recover", whole_file: bool = False,
+                 per_schema: bool = False, workers: int = 1) -> FileResult:
+    """
+    处理单个文件，读写错误和语法错误（on_error=abort）记录在 FileResult.failure 中，不向外抛出。
+    整文件模式下 statements 为实际分析的语句数，命中缓存的语句不计入。
+    """
+    started = time.perf_counter()
+    errors = []
+    statements = 0
+
+    def progress(done, total):
+        nonlocal statements
+        statements = done
+
+    stats = get_parse_stats()
+    analyzed_before = stats.statements
+    try:
+        size = os.path.getsize(input_path)
+        generate = generate_schema_files if per_schema else generate_sql_file
+        output = generate(input_path, schemas, workers, on_error, errors, whole_file, progress)
+    except (OSError, UnicodeDecodeError, SqlSyntaxError, ValueError) as e:
+        return FileResult(input_path, (), statements, 0, time.perf_counter() - started, tuple(errors), str(e))
+    if whole_file:
+        statements = stats.statements - analyzed_before
+    outputs = tuple(output) if per_schema else (output,)
+    return FileResult(input_path, outputs, statements, size, time.perf_counter() - started, tuple(errors), None)
+
+
+def process_files(inputs, schemas, processes: int = 1, cancel_event=None, **options):
+    """
+    依次或并行处理多个文件，按完成顺序产出 FileResult；options 传给 process_file。
+    processes > 1 时文件按大小从大到小提交给进程池，每个文件内部不再并行解析。
+    cancel_event 被设置时不再提交新文件并抛出 GenerationCancelled，已完成的文件保留。
+    """
+    if processes <= 1:
+        for input_path in inputs:
+            check_cancelled(cancel_event)
+            yield process_file(input_path, schemas, **options)
+        return
+
+    options["workers"] = 1
+    queue = iter(sorted(inputs, key=_file_size, reverse=True))
+    with worker_pool(processes) as executor:
+        pending = set()
+        try:
+            while True:
+                while len(pending) < processes * _FILES_PER_WORKER:
+                    input_path = next(queue, None)
+                    if input_path is None:
+                        break
+                    pending.add(executor.submit(process_file, input_path, schemas, **options))
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                check_cancelled(cancel_event)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
@@ -0,0 +1,247 @@
+"""
+切分与改写流水线的性能基准。用固定随机种子生成各类语句的语料，经与正式处理相同的入口
+（iter_sql_statements、build_rewrite_plan、RewritePlan.apply）处理，各阶段耗时取自 sql_utils 的阶段计时：
+
+    split      词法切分语句
+    lex        单条语句的词法分析
+    fast_path  词法快速路径匹配（含批量 INSERT）
+    parse      SLL/LL 语法分析（LL 列为回退到 LL 的语句数），以及设置了 DFA 上限时的检查
+    extract    从解析结果中提取表名位置
+    splice     把改写计划应用到各个 schema
+
+并输出语句/秒、MB/秒和进程峰值内存，结果可保存为 JSON，用于在不同提交之间对比：
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from sql_utils import (
+    PHASES,
+    build_rewrite_plan,
+    caches_disabled,
+    collect_phase_timings,
+    get_parse_stats,
+    iter_sql_statements,
+    load_grammar,
+)
+
+SCHEMAS = ("bench_a", "bench_b", "bench_c")
+
+
+def _table(rng: random.Random) -> str:
+    return f"t_{rng.randrange(1000)}"
+
+
+def gen_small_dml(rng: random.Random, n: int) -> list[str]:
+    statements = []
+    for i in range(n):
+        kind = i % 4
+        if kind == 0:
+            statements.append(f"INSERT INTO {_table(rng)} (id, name, amount) VALUES ({i}, 'name_{i}', {rng.random() * 100:.2f})")
+        elif kind == 1:
+            statements.append(f"UPDATE {_table(rng)} SET name = 'n_{i}', updated_at = NOW() WHERE id = {i}")
+        elif kind == 2:
+            statements.append(f"DELETE FROM {_table(rng)} WHERE id = {i} AND status <> 'keep'")
+        else:
+            statements.append(f"SELECT a.id, b.name FROM {_table(rng)} a JOIN {_table(rng)} b ON a.id = b.id WHERE a.id = {i}")
+    return statements
+
+
+def gen_bulk_insert(rng: random.Random, n: int, rows: int = 500) -> list[str]:
+    statements = []
+    for _ in range(n):
+        values = ",".join(
+            f"({rng.randrange(10 ** 9)},'{rng.randrange(10 ** 6):x}',{rng.random() * 1000:.3f},NULL,'2024-01-01 00:00:00')"
+            for _ in range(rows)
+        )
+        statements.append(f"INSERT INTO {_table(rng)} VALUES {values}")
+    return statements
+
+
+def gen_wide_create_table(rng: random.Random, n: int, columns: int = 120) -> list[str]:
+    types = ("INT NOT NULL DEFAULT 0", "VARCHAR(255) NULL COMMENT 'c'", "DECIMAL(18, 4)", "DATETIME", "TEXT")
+    statements = []
+    for i in range(n):
+        cols = ",\n  ".join(f"col_{c} {types[c % len(types)]}" for c in range(columns))
+        statements.append(
+            f"CREATE TABLE IF NOT EXISTS {_table(rng)}_{i} (\n  id BIGINT AUTO_INCREMENT PRIMARY KEY,\n  {cols},\n"
+            f"  KEY idx_col_1 (col_1),\n  CONSTRAINT fk_{i} FOREIGN KEY (col_0) REFERENCES {_table(rng)} (id)\n"
+            f") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+        )
+    return statements
+
+
+def gen_nested_views(rng: random.Random, n: int, depth: int = 3) -> list[str]:
+    statements = []
+    for i in range(n):
+        query = f"SELECT id, amount FROM {_table(rng)} WHERE amount > {rng.randrange(100)}"
+        for d in range(depth):
+            query = (f"SELECT s{d}.id, SUM(s{d}.amount) AS amount FROM ({query}) s{d} "
+                     f"JOIN {_table(rng)} j{d} ON j{d}.id = s{d}.id "
+                     f"WHERE s{d}.id IN (SELECT id FROM {_table(rng)} WHERE flag = {d}) GROUP BY s{d}.id")
+        statements.append(f"CREATE OR REPLACE VIEW v_{i} AS {query}")
+    return statements
+
+
+def gen_routines(rng: random.Random, n: int) -> list[str]:
+    # 语句切分不支持 DELIMITER，存储过程和触发器使用不含分号的单语句体
+    statements = []
+    for i in range(n):
+        if i % 2 == 0:
+            statements.append(
+                f"CREATE PROCEDURE p_{i}(IN p_id INT, OUT p_total DECIMAL(18, 2)) "
+                f"SELECT SUM(amount) INTO p_total FROM {_table(rng)} WHERE customer_id = p_id"
+            )
+        else:
+            statements.append(
+                f"CREATE TRIGGER trg_{i} AFTER INSERT ON {_table(rng)} FOR EACH ROW "
+                f"INSERT INTO {_table(rng)} (ref_id, action, created_at) VALUES (NEW.id, 'insert', NOW())"
+            )
+    return statements
+
+
+# 类别名 -> (生成函数, 默认语句条数)
+CATEGORIES = {
+    "small_dml": (gen_small_dml, 2000),
+    "bulk_insert": (gen_bulk_insert, 20),
+    "wide_create_table": (gen_wide_create_table, 20),
+    "nested_views": (gen_nested_views, 10),
+    "routines": (gen_routines, 200),
+}
+
+
+def build_corpus(category: str, scale: float, seed: int = 42) -> list[str]:
+    generator, count = CATEGORIES[category]
+    return generator(random.Random(seed), max(1, int(count * scale)))
+
+
+def run_category(statements: list[str]) -> dict:
+    """
+    用 build_rewrite_plan 处理一组语句并按 sql_utils 的阶段统计耗时。
+    绕过 LRU 和持久化缓存，确保每条语句都真正经过分析。
+    """
+    text = ";\n".join(statements) + ";\n"
+    stats = get_parse_stats()
+    fast_path_before, ll_fallbacks_before = stats.fast_path, stats.ll_fallbacks
+    with caches_disabled(), collect_phase_timings() as timings:
+        split = list(iter_sql_statements(text))
+        if len(split) != len(statements):
+            raise RuntimeError(f"切分结果数量不符：{len(split)} != {len(statements)}")
+        for sql in split:
+            plan = build_rewrite_plan(sql)
+            for schema in SCHEMAS:
+                plan.apply(schema)
+
+    total = timings.total
+    size = len(text.encode("utf-8"))
+    return {
+        "statements": len(statements),
+        "bytes": size,
+        "fast_path": stats.fast_path - fast_path_before,
+        "ll_fallbacks": stats.ll_fallbacks - ll_fallbacks_before,
+        "seconds": total,
+        "statements_per_sec": len(statements) / total if total else 0.0,
+        "mb_per_sec": size / 1e6 / total if total else 0.0,
+        "phases": dict(timings.seconds),
+    }
+
+
+def peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(categories, scale: float, repeat: int, warmup: bool = True) -> dict:
+    load_grammar()
+    if warmup:
+        # 预热 DFA，避免第一个类别承担全部的预测缓存构建开销
+        for category in categories:
+            run_category(build_corpus(category, min(scale, 0.05), seed=7))
+
+    results = {}
+    for category in categories:
+        statements = build_corpus(category, scale)
+        runs = [run_category(statements) for _ in range(repeat)]
+        # 取总耗时最短的一次，减少噪声
+        results[category] = min(runs, key=lambda r: r["seconds"])
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": scale,
+        "repeat": repeat,
+        "peak_rss_mb": peak_rss_mb(),
+        "categories": results,
+    }
+
+
+def format_report(report: dict, baseline: dict | None = None) -> str:
+    header = (f"{'category':<18}{'stmts':>7}{'LL':>5}{'stmts/s':>11}{'MB/s':>8}"
+              + "".join(f"{p:>10}" for p in PHASES))
+    if baseline is not None:
+        header += f"{'vs base':>10}"
+    lines = [header]
+    for category, r in report["categories"].items():
+        line = (f"{category:<18}{r['statements']:>7}{r['ll_fallbacks']:>5}"
+                f"{r['statements_per_sec']:>11.1f}{r['mb_per_sec']:>8.3f}"
+                + "".join(f"{r['phases'].get(p, 0.0):>10.3f}" for p in PHASES))
+        base = (baseline or {}).get("categories", {}).get(category)
+        if base and base["statements_per_sec"]:
+            change = r["statements_per_sec"] / base["statements_per_sec"] - 1
+            line += f"{change:>+10.1%}"
+        lines.append(line)
+    rss = report["peak_rss_mb"]
+    lines.append(f"peak RSS: {rss:.1f} MB" if rss is not None else "peak RSS: n/a")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="add-schema 切分与改写流水线性能基准")
+    parser.add_argument("--scale", type=float, default=1.0, help="语料规模倍数（默认 1.0）")
+    parser.add_argument("--repeat", type=int, default=3, help="每个类别重复次数，取最快一次（默认 3）")
+    parser.add_argument("--category", action="append", choices=sorted(CATEGORIES),
+                        help="只运行指定类别，可重复指定")
+    parser.add_argument("--no-warmup", action="store_true", help="不预热 DFA，测量冷启动性能")
+    parser.add_argument("--output", help="把结果保存为 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比语句/秒")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    report = run_benchmark(args.category or list(CATEGORIES), args.scale, max(1, args.repeat),
+                           warmup=not args.no_warmup)
+    print(format_report(report, baseline))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+把预热好的词法/语法 DFA 和 PredictionContextCache 保存到磁盘，下次启动时直接加载，
+省去重新构建 DFA 的冷启动开销（加载约 1 秒，从头预热需要十几秒）。
+
+DFA 状态引用了 ATN 中的状态对象，而 ATN 每次启动都会重新反序列化，
+因此保存时把 ATN 状态替换为状态编号，加载时再映射回当前进程中的对象；
+运行时中用 is 比较的单例（ERROR 状态、EMPTY 上下文等）同样按名称映射回原对象。
+快照按语法版本命名，语法重新生成后自动失效。
+"""
+import os
+import pickle
+
+from antlr4.PredictionContext import PredictionContext
+from antlr4.atn.ATNSimulator import ATNSimulator
+from antlr4.atn.ATNState import ATNState
+from antlr4.atn.LexerATNSimulator import LexerATNSimulator
+from antlr4.atn.LexerAction import LexerMoreAction, LexerPopModeAction, LexerSkipAction
+from antlr4.atn.SemanticContext import SemanticContext
+
+import sql_utils
+from parse_cache import default_cache_path, grammar_version
+
+# 最近一次 warm_dfa() 使用的快照路径，并行模式下子进程从这里加载
+_snapshot_path = None
+
+
+def default_dfa_path() -> str:
+    """
+    与持久化解析缓存位于同一目录，文件名包含语法版本。
+    """
+    return os.path.join(os.path.dirname(default_cache_path()), f"dfa-{grammar_version()[:16]}.pickle")
+
+
+_SINGLETONS = {
+    "parser_error": ATNSimulator.ERROR,
+    "lexer_error": LexerATNSimulator.ERROR,
+    "empty_context": PredictionContext.EMPTY,
+    "none_semantic": SemanticContext.NONE,
+    "lexer_skip": LexerSkipAction.INSTANCE,
+    "lexer_more": LexerMoreAction.INSTANCE,
+    "lexer_pop_mode": LexerPopModeAction.INSTANCE,
+}
+_SINGLETON_NAMES = {id(obj): name for name, obj in _SINGLETONS.items()}
+
+
+class _DfaPickler(pickle.Pickler):
+    def __init__(self, file, parser_atn):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._parser_atn = parser_atn
+
+    def persistent_id(self, obj):
+        if isinstance(obj, ATNState):
+            return obj.atn is self._parser_atn, obj.stateNumber
+        return _SINGLETON_NAMES.get(id(obj))
+
+
+class _DfaUnpickler(pickle.Unpickler):
+    def __init__(self, file, parser_atn, lexer_atn):
+        super().__init__(file)
+        self._parser_atn = parser_atn
+        self._lexer_atn = lexer_atn
+
+    def persistent_load(self, pid):
+        if isinstance(pid, str):
+            return _SINGLETONS[pid]
+        is_parser, state_number = pid
+        return (self._parser_atn if is_parser else self._lexer_atn).states[state_number]
+
+
+def save_dfa(path: str = None) -> bool:
+    """
+    把当前进程的 DFA 写入快照文件（先写临时文件再替换）。DFA 过深无法序列化或写入失败（如磁盘已满、
+    缓存目录不可写）时返回 False，快照只是加速手段，不影响本次处理的结果。
+    """
+    sql_utils.load_grammar()
+    parser_class, lexer_class = sql_utils.MySqlParser, sql_utils.MySqlLexer
+    path = path or default_dfa_path()
+    snapshot = (
+        [(dfa.states, dfa.s0) for dfa in parser_class.decisionsToDFA],
+        [(dfa.states, dfa.s0) for dfa in lexer_class.decisionsToDFA],
+        parser_class.sharedContextCache.cache,
+    )
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            _DfaPickler(f, parser_class.atn).dump(snapshot)
+        os.replace(tmp_path, path)
+    except (OSError, RecursionError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def load_dfa(path: str = None) -> bool:
+    """
+    从快照文件恢复 DFA，文件不存在或无法读取时返回 False，此时 DFA 保持不变。
+    应在开始解析之前调用，快照只应来自本机用户自己的缓存目录。
+    """
+    sql_utils.load_grammar()
+    parser_class, lexer_class = sql_utils.MySqlParser, sql_utils.MySqlLexer
+    try:
+        with open(path or default_dfa_path(), "rb") as f:
+            parser_dfas, lexer_dfas, contexts = _DfaUnpickler(f, parser_class.atn, lexer_class.atn).load()
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, IndexError, KeyError, ValueError, RecursionError):
+        return False
+    if len(parser_dfas) != len(parser_class.decisionsToDFA) or len(lexer_dfas) != len(lexer_class.decisionsToDFA):
+        return False
+
+    for dfa, (states, s0) in zip(parser_class.decisionsToDFA, parser_dfas):
+        dfa._states, dfa.s0 = states, s0
+    for dfa, (states, s0) in zip(lexer_class.decisionsToDFA, lexer_dfas):
+        dfa._states, dfa.s0 = states, s0
+    parser_class.sharedContextCache.cache = contexts
+    return True
+
+
+def warm_dfa(path: str = None) -> bool:
+    """
+    优先加载 DFA 快照；没有可用快照时用 WARM_UP_CORPUS 预热并保存快照，供之后的运行和并行子进程加载。
+    返回是否命中快照。
+    """
+    global _snapshot_path
+    path = path or default_dfa_path()
+    _snapshot_path = path
+    if load_dfa(path):
+        return True
+    sql_utils.warm_up_dfa()
+    save_dfa(path)
+    return False
+
+
+def get_snapshot_path() -> str | None:
+    return _snapshot_path
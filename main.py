@@ -1,14 +1,23 @@
+import multiprocessing
 import os
-import pathlib
+import queue
+import threading
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 
-from sqlglot.errors import *
-
-from sql_utils import (
-    split_sql_statements,
-    add_schema_to_sql,
+from sql_generator import (
+    DEFAULT_SCHEMAS_CONF,
+    GenerationCancelled,
+    read_schemas_file,
+    output_path_for,
+    iter_file_rewrite_plans,
+    resolve_workers,
+    write_generated_sql,
 )
+import dfa_cache
+from batch import process_files, resolve_inputs, summarize
+from sql_utils import PhaseTimings, collect_phase_timings, dfa_size, load_grammar
 
 class MySQLAddSchemaApp(tk.Tk):
     def __init__(self):
@@ -21,7 +30,10 @@ class MySQLAddSchemaApp(tk.Tk):
         self.schemas = []
         # 文件选择按钮
         self.file_btn = tk.Button(self, text="选择SQL文件", font=("Arial", 12), height=2, command=self.select_file)
-        self.file_btn.pack(fill=tk.X, padx=10, pady=10)
+        self.file_btn.pack(fill=tk.X, padx=10, pady=(10, 0))
+        # 选择目录时批量处理其中所有的 .sql 文件
+        self.dir_btn = tk.Button(self, text="选择目录（批量处理）", font=("Arial", 12), command=self.select_directory)
+        self.dir_btn.pack(fill=tk.X, padx=10, pady=(5, 10))
 
         # schema选择区域
         self.schema_frame = ttk.LabelFrame(self, text="选择Schema")
@@ -57,8 +69,51 @@ class MySQLAddSchemaApp(tk.Tk):
         self.confirm_btn = tk.Button(self, text="生成SQL", font=("Arial", 12), height=2, bg="#4CAF50", fg="black",
                                      command=self.generate_sql)
         self.confirm_btn.pack(fill=tk.X, padx=10, pady=10)
+
+        # 进度条和取消按钮
+        self.progress_frame = tk.Frame(self)
+        self.progress_frame.pack(fill=tk.X, padx=10, pady=(0, 5))
+        self.progress_bar = ttk.Progressbar(self.progress_frame, mode="determinate")
+        self.progress_bar.pack(side="left", fill=tk.X, expand=True)
+        self.cancel_btn = tk.Button(self.progress_frame, text="取消", state=tk.DISABLED,
+                                    command=self.cancel_generation)
+        self.cancel_btn.pack(side="right", padx=(10, 0))
+        self.status_var = tk.StringVar()
+        self.status_label = tk.Label(self, textvariable=self.status_var, anchor="w")
+        self.status_label.pack(fill=tk.X, padx=10, pady=(0, 10))
+
+        # 后台生成线程的状态：进度只保留最新值，结束事件通过队列交给主线程
+        self.worker = None
+        self.cancel_event = None
+        self.worker_events = queue.Queue()
+        self.latest_progress = None
+        self.progress_unit = "MB"
+        self.started_at = 0.0
+        self.phase_timings = PhaseTimings()
+
         self.load_schemas()
 
+        # 语法模块加载和 DFA 预热较慢，在后台线程中进行，窗口无需等待
+        self.warm_size = None
+        self.warm_up_thread = threading.Thread(target=self._warm_up, daemon=True)
+        self.warm_up_thread.start()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
+    def _warm_up(self):
+        load_grammar()
+        dfa_cache.warm_dfa()
+        self.warm_size = dfa_size()
+
+    def _on_close(self):
+        # 正在生成时先取消并等待后台线程结束，由它删除临时输出文件；直接退出会终止守护线程并留下 .tmp 文件
+        if self.worker is not None:
+            self.cancel_event.set()
+            self.worker.join()
+        # 本次使用中新增了 DFA 状态时保存快照，下次启动直接加载
+        if self.warm_size is not None and dfa_size() != self.warm_size:
+            dfa_cache.save_dfa()
+        self.destroy()
+
     def _bind_mousewheel(self, widget):
         # 只在内容超出时绑定鼠标滚轮
         widget.bind("<Enter>", self._maybe_bind_mousewheel)
@@ -139,23 +194,30 @@ class MySQLAddSchemaApp(tk.Tk):
         if file_name:
             self.selected_file = file_name
             self.file_btn.config(text="已选择: " + os.path.basename(file_name))
+            self.dir_btn.config(text="选择目录（批量处理）")
+
+    def select_directory(self):
+        directory = filedialog.askdirectory(title="选择包含SQL文件的目录")
+        if directory:
+            self.selected_file = directory
+            self.dir_btn.config(text="已选择目录: " + os.path.basename(os.path.normpath(directory)))
+            self.file_btn.config(text="选择SQL文件")
 
     def load_schemas(self):
-        config_path = os.path.expanduser("~/schemas.conf")
-        if os.path.exists(config_path):
-            with open(config_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    schema = line.strip()
-                    if schema:
-                        var = tk.BooleanVar()
-                        # 绑定每个schema勾选框的变化到update_select_all
-                        var.trace_add("write", self.update_select_all)
-                        cb = tk.Checkbutton(self.schema_inner, text=schema, variable=var, anchor="w")
-                        cb.pack(fill=tk.X, padx=5, pady=2, anchor="w")
-                        self.schema_vars.append(var)
-                        self.schemas.append(schema)
+        if os.path.exists(DEFAULT_SCHEMAS_CONF):
+            for schema in read_schemas_file(DEFAULT_SCHEMAS_CONF):
+                var = tk.BooleanVar()
+                # 绑定每个schema勾选框的变化到update_select_all
+                var.trace_add("write", self.update_select_all)
+                cb = tk.Checkbutton(self.schema_inner, text=schema, variable=var, anchor="w")
+                cb.pack(fill=tk.X, padx=5, pady=2, anchor="w")
+                self.schema_vars.append(var)
+                self.schemas.append(schema)
 
     def generate_sql(self):
+        if self.worker is not None:
+            return
+
         if not self.selected_file:
             self.show_warning("请先选择SQL文件！")
             return
@@ -165,42 +227,137 @@ class MySQLAddSchemaApp(tk.Tk):
             self.show_warning("请至少选择一个Schema！")
             return
 
+        self.cancel_event = threading.Event()
+        self.latest_progress = None
+        self.progress_unit = "个文件" if os.path.isdir(self.selected_file) else "MB"
+        self.started_at = time.perf_counter()
+        self.phase_timings = PhaseTimings()
+        self.confirm_btn.config(state=tk.DISABLED)
+        self.file_btn.config(state=tk.DISABLED)
+        self.dir_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.progress_bar.config(value=0, maximum=1)
+        self.status_var.set("正在预热解析器..." if self.warm_up_thread.is_alive() else "正在读取SQL文件...")
+
+        self.worker = threading.Thread(
+            target=self._generate_worker,
+            args=(self.selected_file, selected_schemas, self.cancel_event),
+            daemon=True,
+        )
+        self.worker.start()
+        self.after(100, self._poll_worker)
+
+    def cancel_generation(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_btn.config(state=tk.DISABLED)
+            self.status_var.set("正在取消...")
+
+    def _generate_worker(self, input_path, schemas, cancel_event):
+        # 在后台线程中运行，不能直接操作 Tk 控件
+        # DFA 不支持多线程同时修改，等预热结束后再开始解析
+        self.warm_up_thread.join()
+        # 预热期间点击了取消
+        if cancel_event.is_set():
+            self.worker_events.put(("cancelled", None))
+            return
+        with collect_phase_timings(self.phase_timings):
+            if os.path.isdir(input_path):
+                self._run_batch(input_path, schemas, cancel_event)
+            else:
+                self._run_generation(input_path, schemas, cancel_event)
+
+    def _run_batch(self, directory, schemas, cancel_event):
+        # 按文件分给多个进程处理，大文件优先；各阶段耗时只统计主进程，这里不显示
+        inputs = []
+        results = []
         try:
-            with open(self.selected_file, "r", encoding="utf-8") as f:
-                sql_content = f.read()
-        except PermissionError:
-            self.show_warning("读取源SQL文件权限不足！")
+            inputs = resolve_inputs([directory])
+            if not inputs:
+                self.worker_events.put(("warning", "所选目录中没有SQL文件！"))
+                return
+            for result in process_files(inputs, schemas, resolve_workers(0), cancel_event):
+                results.append(result)
+                self.latest_progress = (len(results), len(inputs))
+        except GenerationCancelled:
+            self.worker_events.put(("cancelled", f"已取消，已完成 {len(results)}/{len(inputs)} 个文件"))
             return
-        except OSError:
-            self.show_warning("无法打开源SQL文件！")
+        except Exception as e:
+            self.worker_events.put(("warning", f"批量处理失败：{e}"))
             return
 
+        summary = summarize(results, time.perf_counter() - self.started_at)
+        failures = [f"{os.path.relpath(r.input_path, directory)}: {r.failure}" for r in results if r.failure is not None]
+        message = str(summary)
+        if failures:
+            message += "\n\n处理失败的文件：\n" + "\n".join(failures[:10])
+            if len(failures) > 10:
+                message += f"\n……共 {len(failures)} 个"
+        self.worker_events.put(("batch_done", message))
+
+    def _run_generation(self, input_path, schemas, cancel_event):
+        def progress(bytes_read, file_size):
+            self.latest_progress = (bytes_read, file_size)
+
+        # 边读边解析边写出，内存占用与文件大小无关；进度按已读取的字节数计算
+        output_file_name = output_path_for(input_path)
         try:
-            sql_statements = split_sql_statements(sql_content)
-
-            p = pathlib.Path(self.selected_file)
-            output_file_name = str(p.with_name(p.stem + '_generated.sql'))
-
-            # 先处理所有 SQL 语句，收集结果到内存
-            output_lines = []
-            for schema in selected_schemas:
-                for statement in sql_statements:
-                    if statement.strip():
-                        new_sql = add_schema_to_sql(statement, schema)
-                        output_lines.append(new_sql.strip() + ";\n\n")
-            
-            # 只有在所有处理都成功后，才写入文件
-            with open(output_file_name, "w", encoding="utf-8") as out:
-                out.writelines(output_lines)
-            
-            messagebox.showinfo("成功", "文件生成成功！\n输出文件: " + output_file_name)
-        except (ParseError, TokenError, OptimizeError):
-            self.show_warning("源SQL文件解析失败！")
-        except PermissionError:
-            self.show_warning("写入目标SQL文件权限不足！")
-        except OSError:
-            self.show_warning("写入目标SQL文件失败！")
+            plans = iter_file_rewrite_plans(input_path, cancel_event=cancel_event, byte_progress=progress)
+            write_generated_sql(output_file_name, plans, schemas, cancel_event)
+            self.worker_events.put(("done", output_file_name))
+        except GenerationCancelled:
+            self.worker_events.put(("cancelled", None))
+        except PermissionError as e:
+            reading = e.filename == input_path
+            self.worker_events.put(("warning", "读取源SQL文件权限不足！" if reading else "写入目标SQL文件权限不足！"))
+        except OSError as e:
+            reading = e.filename == input_path
+            self.worker_events.put(("warning", "无法打开源SQL文件！" if reading else "写入目标SQL文件失败！"))
+        except Exception as e:
+            self.worker_events.put(("warning", f"处理源SQL文件失败：{e}"))
+
+    def _poll_worker(self):
+        progress = self.latest_progress
+        if progress is not None:
+            done, total = progress
+            elapsed = time.perf_counter() - self.started_at
+            rate = done / elapsed if elapsed > 0 else 0.0
+            self.progress_bar.config(value=done, maximum=max(total, 1))
+            if self.progress_unit == "MB":
+                self.status_var.set(f"已处理 {done / 1e6:.1f}/{total / 1e6:.1f} MB，{rate / 1e6:.1f} MB/秒")
+            else:
+                self.status_var.set(f"已处理 {done}/{total} {self.progress_unit}，{rate:.1f} {self.progress_unit[-1]}/秒")
+
+        try:
+            kind, payload = self.worker_events.get_nowait()
+        except queue.Empty:
+            self.after(100, self._poll_worker)
+            return
+
+        self.worker = None
+        self.cancel_event = None
+        self.confirm_btn.config(state=tk.NORMAL)
+        self.file_btn.config(state=tk.NORMAL)
+        self.dir_btn.config(state=tk.NORMAL)
+        self.cancel_btn.config(state=tk.DISABLED)
+        if kind == "done":
+            # 状态栏附上耗时最多的几个阶段，便于判断慢在哪里
+            slowest = sorted(self.phase_timings.seconds.items(), key=lambda item: item[1], reverse=True)[:3]
+            self.status_var.set(f"完成，用时 {time.perf_counter() - self.started_at:.1f} 秒（"
+                                + "，".join(f"{phase} {seconds:.2f}s" for phase, seconds in slowest) + "）")
+            messagebox.showinfo("成功", "文件生成成功！\n输出文件: " + payload)
+        elif kind == "batch_done":
+            self.status_var.set(payload.splitlines()[0])
+            messagebox.showinfo("批量处理完成", payload)
+        elif kind == "cancelled":
+            self.progress_bar.config(value=0)
+            self.status_var.set(payload or "已取消，未生成输出文件")
+        else:
+            self.status_var.set("")
+            self.show_warning(payload)
 
 if __name__ == "__main__":
+    # 打包为单文件程序后，批量处理的子进程会重新执行入口脚本，需要先交给 multiprocessing 处理
+    multiprocessing.freeze_support()
     app = MySQLAddSchemaApp()
     app.mainloop()
\ No newline at end of file
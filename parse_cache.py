@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+# 缓存格式版本；替换元组的含义或存储格式变化时递增，旧缓存会被自动清空
+CACHE_FORMAT_VERSION = 1
+
+DEFAULT_MAX_ENTRIES = 200_000
+
+# 新条目和最近使用时间先缓存在内存中，累计多少条后在一个短事务中写入
+_COMMIT_INTERVAL = 500
+
+_grammar_version = None
+
+
+def default_cache_path() -> str:
+    """
+    用户缓存目录下的 add-schema/parse_cache.sqlite3。
+    """
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "add-schema", "parse_cache.sqlite3")
+
+
+def grammar_version() -> str:
+    """
+    由词法/语法 ATN 和缓存格式版本计算出的摘要，语法重新生成后缓存自动失效。
+    """
+    global _grammar_version
+    if _grammar_version is None:
+        from MySqlLexer import serializedATN as lexer_atn
+        from MySqlParser import serializedATN as parser_atn
+
+        digest = hashlib.sha256()
+        digest.update(str(CACHE_FORMAT_VERSION).encode())
+        digest.update(repr(lexer_atn()).encode())
+        digest.update(repr(parser_atn()).encode())
+        _grammar_version = digest.hexdigest()
+    return _grammar_version
+
+
+class ParseCache:
+    """
+    基于 SQLite 的持久化解析缓存：语句 SHA-256 摘要 -> 需要添加 schema 的表名位置。
+    条目数超过 max_entries 时按最近使用时间淘汰最旧的条目。
+
+    多个进程（-j N）共用同一个缓存文件，因此 get / put 不直接写数据库：新条目和命中条目的最近使用时间
+    先缓存在内存中，攒够一批或 flush() 时在一个很短的事务中写入，不会长时间持有写锁阻塞其他进程。
+    缓存只是加速手段，数据库出错（如被其他程序锁住超时）时按未命中处理或丢弃这批写入，errors 记录出错次数。
+    """
+
+    def __init__(self, path: str = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path or default_cache_path()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        # 尚未写入数据库的新条目：摘要 -> (替换 JSON, 最近使用时间)
+        self._pending: dict[bytes, tuple[str, int]] = {}
+        # 命中后尚未写回的最近使用时间：摘要 -> 最近使用时间
+        self._touched: dict[bytes, int] = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " digest BLOB PRIMARY KEY,"
+            " replacements TEXT NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+        version = grammar_version()
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'grammar_version'").fetchone()
+        if row is None or row[0] != version:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('grammar_version', ?)", (version,))
+        self._conn.commit()
+
+        self._count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self._clock = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def _digest(sql: str) -> bytes:
+        return hashlib.sha256(sql.encode("utf-8")).digest()
+
+    def get(self, sql: str) -> tuple[tuple[int, int, str], ...] | None:
+        digest = self._digest(sql)
+        with self._lock:
+            self._clock += 1
+            pending = self._pending.get(digest)
+            if pending is not None:
+                self.hits += 1
+                self._pending[digest] = (pending[0], self._clock)
+                return self._decode(pending[0])
+            try:
+                row = self._conn.execute("SELECT replacements FROM entries WHERE digest = ?", (digest,)).fetchone()
+            except sqlite3.Error:
+                self.errors += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[digest] = self._clock
+            self._after_write()
+        return self._decode(row[0])
+
+    @staticmethod
+    def _decode(replacements: str) -> tuple[tuple[int, int, str], ...]:
+        return tuple((start, stop, table_name) for start, stop, table_name in json.loads(replacements))
+
+    def put(self, sql: str, replacements: tuple[tuple[int, int, str], ...]):
+        digest = self._digest(sql)
+        with self._lock:
+            self._clock += 1
+            self._pending[digest] = (json.dumps(replacements, ensure_ascii=False), self._clock)
+            if self._count + len(self._pending) > self.max_entries:
+                self._write_pending()
+            else:
+                self._after_write()
+
+    def _write_pending(self):
+        """
+        在一个事务中写入缓冲的新条目和最近使用时间，必要时淘汰旧条目，随即提交。出错时丢弃这批写入。
+        """
+        pending, touched = self._pending, self._touched
+        self._pending, self._touched = {}, {}
+        if not pending and not touched:
+            return
+        count, evictions = self._count, self.evictions
+        try:
+            with self._conn:
+                if touched:
+                    self._conn.executemany("UPDATE entries SET last_used = ? WHERE digest = ?",
+                                           [(clock, digest) for digest, clock in touched.items()])
+                if pending:
+                    cursor = self._conn.executemany(
+                        "INSERT OR IGNORE INTO entries (digest, replacements, last_used) VALUES (?, ?, ?)",
+                        [(digest, replacements, clock) for digest, (replacements, clock) in pending.items()],
+                    )
+                    self._count += cursor.rowcount
+                if self._count > self.max_entries:
+                    self._evict()
+        except sqlite3.Error:
+            self.errors += 1
+            self._count, self.evictions = count, evictions
+
+    def _evict(self):
+        # 一次多淘汰 10%，避免之后每次写入都触发淘汰
+        target = int(self.max_entries * 0.9)
+        excess = self._count - target
+        cursor = self._conn.execute(
+            "DELETE FROM entries WHERE digest IN (SELECT digest FROM entries ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self.evictions += cursor.rowcount
+        self._count -= cursor.rowcount
+
+    def _after_write(self):
+        if len(self._pending) + len(self._touched) >= _COMMIT_INTERVAL:
+            self._write_pending()
+
+    def __len__(self):
+        return self._count + len(self._pending)
+
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._write_pending()
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,113 @@
+"""
+逐条语句的解析性能剖析：记录每条语句的耗时、是否从 SLL 回退到 LL，
+以及 LL 预测中的全上下文（full-context）预测次数、歧义和上下文相关决策次数，
+用于找出拖慢整个文件的少数病态语句（深层嵌套表达式、超长 IN 列表等）。
+
+Python 版 ANTLR 运行时没有 ProfilingATNSimulator，这里通过 ErrorListener 的
+reportAttemptingFullContext / reportAmbiguity / reportContextSensitivity 回调收集同样的信息。
+"""
+import time
+from typing import NamedTuple
+
+from antlr4.error.ErrorListener import ErrorListener
+
+import sql_utils
+from sql_utils import caches_disabled, iter_sql_statements_with_positions, get_parse_stats
+
+
+class StatementProfile(NamedTuple):
+    index: int
+    line: int
+    seconds: float
+    fast_path: bool
+    ll_fallback: bool
+    full_context: int
+    ambiguities: int
+    context_sensitivities: int
+    sql: str
+
+
+class DecisionCounter(ErrorListener):
+    """
+    统计语法分析过程中的全上下文预测、歧义和上下文相关决策次数。
+    """
+
+    def __init__(self):
+        self.full_context = 0
+        self.ambiguities = 0
+        self.context_sensitivities = 0
+
+    def reportAttemptingFullContext(self, recognizer, dfa, startIndex, stopIndex, conflictingAlts, configs):
+        self.full_context += 1
+
+    def reportAmbiguity(self, recognizer, dfa, startIndex, stopIndex, exact, ambigAlts, configs):
+        self.ambiguities += 1
+
+    def reportContextSensitivity(self, recognizer, dfa, startIndex, stopIndex, prediction, configs):
+        self.context_sensitivities += 1
+
+
+def profile_statement(sql: str, index: int = 0, line: int = 1) -> StatementProfile:
+    """
+    不经过任何缓存，重新分析一条语句并记录耗时和预测统计。
+    """
+    sql_utils.load_grammar()
+    counter = DecisionCounter()
+    stats = get_parse_stats()
+    fast_path_before = stats.fast_path
+    fallbacks_before = stats.ll_fallbacks
+
+    started = time.perf_counter()
+    with caches_disabled():
+        sql_utils._analyze_statement(sql, counter)
+    seconds = time.perf_counter() - started
+
+    return StatementProfile(
+        index=index,
+        line=line,
+        seconds=seconds,
+        fast_path=stats.fast_path > fast_path_before,
+        ll_fallback=stats.ll_fallbacks > fallbacks_before,
+        full_context=counter.full_context,
+        ambiguities=counter.ambiguities,
+        context_sensitivities=counter.context_sensitivities,
+        sql=sql,
+    )
+
+
+def profile_statements(source, progress=None) -> list[StatementProfile]:
+    """
+    切分 source（字符串或文本文件对象）并逐条剖析，按原始顺序返回。
+    """
+    profiles = []
+    for index, (line, _, sql) in enumerate(iter_sql_statements_with_positions(source)):
+        profiles.append(profile_statement(sql, index, line))
+        if progress is not None:
+            progress(len(profiles))
+    return profiles
+
+
+def slowest(profiles, n: int = 10) -> list[StatementProfile]:
+    return sorted(profiles, key=lambda p: p.seconds, reverse=True)[:n]
+
+
+def format_profile_report(profiles, n: int = 10, name: str = "") -> str:
+    """
+    汇总统计加上最慢的 n 条语句，语句只显示开头一段。
+    """
+    total = sum(p.seconds for p in profiles)
+    fallbacks = sum(p.ll_fallback for p in profiles)
+    lines = [
+        f"{name}{': ' if name else ''}{len(profiles)} 条语句，共 {total:.3f} 秒，"
+        f"快速路径 {sum(p.fast_path for p in profiles)} 条，LL 回退 {fallbacks} 条，"
+        f"全上下文预测 {sum(p.full_context for p in profiles)} 次，歧义 {sum(p.ambiguities for p in profiles)} 次",
+        f"{'#':>6}{'line':>8}{'seconds':>10}{'share':>8}{'LL':>4}{'fullctx':>9}{'ambig':>7}  sql",
+    ]
+    for p in slowest(profiles, n):
+        share = p.seconds / total if total else 0.0
+        preview = " ".join(p.sql.split())
+        if len(preview) > 80:
+            preview = preview[:77] + "..."
+        lines.append(f"{p.index + 1:>6}{p.line:>8}{p.seconds:>10.3f}{share:>8.1%}{'Y' if p.ll_fallback else '':>4}"
+                     f"{p.full_context:>9}{p.ambiguities:>7}  {preview}")
+    return "\n".join(lines)
@@ -1,8 +1,30 @@
+import sys
+
 from antlr4 import *
 from MySqlParserListener import MySqlParserListener
 from MySqlParser import MySqlParser
 
 
+def table_replacement(ctx: MySqlParser.TableNameContext) -> tuple[int, int, str] | None:
+    """
+    返回未带 schema 的表名在原始 SQL 文本中的位置及原始表名；已经带 schema 时返回 None。
+    不依赖 ctx 的子节点，关闭语法树构建时同样可用。
+    """
+    start, stop = ctx.start, ctx.stop
+    # 表名由多个 token 组成时一定带有 schema（如 mydb.table）；错误恢复时 stop 可能在 start 之前
+    if stop is None or start.tokenIndex != stop.tokenIndex:
+        return None
+
+    # 获取表名 token
+    table_name = start.text
+
+    # 如果已经有 schema（如 `mydb.table`），则跳过
+    if '.' in table_name:
+        return None
+
+    return start.start, stop.stop, table_name
+
+
 class SchemaModifierListener(MySqlParserListener):
     """
     收集所有未带 schema 的表名在原始 SQL 文本中的位置及原始表名。
@@ -12,17 +34,36 @@ class SchemaModifierListener(MySqlParserListener):
         self.replacements: list[tuple[int, int, str]] = []  # (start_idx, end_idx, table_name)
 
     def enterTableName(self, ctx: MySqlParser.TableNameContext):
-        # 获取表名 token
-        table_name = ctx.getText()
+        replacement = table_replacement(ctx)
+        if replacement is not None:
+            # 记录替换
+            self.replacements.append(replacement)
+
+
+class TableNameCollectingParser(MySqlParser):
+    """
+    在解析过程中直接记录每次 tableName 规则的调用结果，不再构建语法树、也不需要事后遍历，
+    开销只与表引用数量有关，与语法树大小无关。结果与 SchemaModifierListener 相同。
+    """
 
-        # 如果已经有 schema（如 mydb.table），则跳过
-        if '.' in table_name:
-            return
+    def __init__(self, input: TokenStream, output=sys.stdout):
+        super().__init__(input, output)
+        self.buildParseTrees = False
+        self.table_name_contexts: list[MySqlParser.TableNameContext] = []
 
-        # 获取 token 位置
-        start = ctx.start.start
-        stop = ctx.stop.stop
+    def reset(self):
+        super().reset()
+        self.table_name_contexts = []
 
-        # 记录替换
-        self.replacements.append((start, stop, table_name))
+    def tableName(self):
+        localctx = super().tableName()
+        self.table_name_contexts.append(localctx)
+        return localctx
 
+    def table_replacements(self) -> list[tuple[int, int, str]]:
+        replacements = []
+        for ctx in self.table_name_contexts:
+            replacement = table_replacement(ctx)
+            if replacement is not None:
+                replacements.append(replacement)
+        return replacements
@@ -0,0 +1,497 @@
+import codecs
+import mmap
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+
+import dfa_cache
+from sql_utils import (
+    RewritePlan,
+    SqlSyntaxError,
+    iter_sql_statements_with_positions,
+    build_rewrite_plan,
+    build_script_rewrite_plan,
+    script_ends_with_terminator,
+    enable_parse_cache,
+    get_parse_cache,
+    flush_parse_cache,
+    get_dfa_limits,
+    set_dfa_limits,
+    get_phase_timings,
+)
+
+# 默认的 schema 配置文件：用户主目录下的 schemas.conf，每行一个 schema
+DEFAULT_SCHEMAS_CONF = os.path.expanduser("~/schemas.conf")
+
+# 并行模式下每次提交给子进程的语句条数，以及每个子进程最多排队的批次数
+_PARALLEL_BATCH_SIZE = 200
+_PARALLEL_BATCHES_PER_WORKER = 2
+
+# 每个 schema 输出单独文件时，写文件的线程数上限
+_OUTPUT_THREADS = 8
+
+# 非 ASCII 脚本换算字节偏移时每次编码的字符数，避免一次性编码整个脚本
+_ENCODE_CHUNK_SIZE = 1024 * 1024
+
+# 语句存在语法错误时的处理方式：
+# recover 沿用解析器的错误恢复继续改写（默认）；其余三种使用严格模式，遇到第一个语法错误即停止解析该语句，
+# skip 从输出中去掉该语句，passthrough 原样输出不加 schema，abort 终止整个文件的处理、不生成输出文件
+ON_ERROR_POLICIES = ("recover", "skip", "passthrough", "abort")
+
+
+def read_schemas_file(config_path: str = DEFAULT_SCHEMAS_CONF) -> list[str]:
+    """
+    读取 schema 配置文件，忽略空行。
+    """
+    schemas = []
+    with open(config_path, "r", encoding="utf-8") as f:
+        for line in f:
+            schema = line.strip()
+            if schema:
+                schemas.append(schema)
+    return schemas
+
+
+def output_path_for(input_path: str) -> str:
+    """
+    生成文件与源文件同目录，命名为 <stem>_generated.sql。
+    """
+    p = pathlib.Path(input_path)
+    return str(p.with_name(p.stem + '_generated.sql'))
+
+
+def schema_output_path_for(input_path: str, schema: str) -> str:
+    """
+    每个 schema 单独输出时，生成文件与源文件同目录，命名为 <stem>_<schema>.sql。
+    """
+    if not schema or any(sep in schema for sep in ("/", "\\", os.sep)):
+        raise ValueError(f"schema 名称不能用作文件名: {schema!r}")
+    p = pathlib.Path(input_path)
+    return str(p.with_name(f"{p.stem}_{schema}.sql"))
+
+
+def resolve_workers(workers: int | None) -> int:
+    """
+    workers 为 None 或 0 时使用全部 CPU 核心。
+    """
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, workers)
+
+
+def iter_rewrite_plans(statements, workers: int = 1, strict: bool = False):
+    """
+    为每条语句生成改写计划，按原始顺序逐条产出。
+    workers > 1 时把语句分批交给进程池解析，同时在途的批次数有上限，不会一次性读入所有语句。
+    strict=True 时存在语法错误的语句产出 SqlSyntaxError 而不是改写计划，由调用方决定如何处理。
+    """
+    if workers <= 1:
+        for statement in statements:
+            yield _build_plan(statement, strict)
+        return
+
+    statements = iter(statements)
+    with worker_pool(workers) as executor:
+        pending = deque()
+        while True:
+            while len(pending) < workers * _PARALLEL_BATCHES_PER_WORKER:
+                batch = list(islice(statements, _PARALLEL_BATCH_SIZE))
+                if not batch:
+                    break
+                pending.append((batch, executor.submit(_get_replacements_batch, batch, strict)))
+            if not pending:
+                return
+            batch, future = pending.popleft()
+            # 子进程只回传替换位置，语句原文留在主进程，减少进程间传输
+            for statement, replacements in zip(batch, future.result()):
+                yield replacements if isinstance(replacements, SqlSyntaxError) else RewritePlan(statement, replacements)
+
+
+def _build_plan(statement, strict):
+    try:
+        return build_rewrite_plan(statement, strict)
+    except SqlSyntaxError as e:
+        return e
+
+
+def worker_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    创建解析用的进程池：子进程沿用主进程的持久化缓存、DFA 快照和 DFA 上限设置，并在启动时预热解析器。
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=_worker_initargs())
+
+
+def _worker_initargs():
+    # 主进程启用了持久化缓存时，子进程使用同一个缓存文件
+    cache = get_parse_cache()
+    cache_args = (cache.path, cache.max_entries) if cache is not None else None
+    # 主进程预热过 DFA 时，子进程加载同一个快照
+    dfa_path = dfa_cache.get_snapshot_path()
+    limits = get_dfa_limits()
+    limits_args = (limits.max_states, limits.max_statements, limits.check_interval) if limits is not None else None
+    return cache_args, dfa_path, limits_args
+
+
+def _init_worker(cache_args, dfa_path, limits_args):
+    if cache_args is not None:
+        try:
+            enable_parse_cache(*cache_args)
+        except sqlite3.Error:
+            # 缓存文件暂时无法打开时该子进程不使用缓存，不影响改写结果
+            pass
+    if limits_args is not None:
+        set_dfa_limits(*limits_args)
+    if dfa_path is not None:
+        dfa_cache.load_dfa(dfa_path)
+    # 子进程启动时先完成语法模块导入和 ATN 反序列化，并预热一次解析器
+    build_rewrite_plan("SELECT 1 FROM dual")
+
+
+def _get_replacements_batch(statements, strict):
+    replacements = []
+    for statement in statements:
+        plan = _build_plan(statement, strict)
+        replacements.append(plan if isinstance(plan, SqlSyntaxError) else plan.replacements)
+    # 子进程退出时不会执行 atexit，每批结束后提交缓存
+    flush_parse_cache()
+    return replacements
+
+
+class GenerationCancelled(Exception):
+    """
+    生成过程被用户取消，此时不会写出任何输出文件。
+    """
+
+
+def check_cancelled(cancel_event):
+    """
+    cancel_event 被设置时抛出 GenerationCancelled；cancel_event 为 None 时不做任何事。
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelled()
+
+
+def iter_file_rewrite_plans(input_path: str, workers: int = 1, progress=None, cancel_event=None,
+                            on_error: str = "recover", errors: list = None, byte_progress=None):
+    """
+    按块流式读取并切分源文件中的语句，每条语句只解析一次，边读边解析、逐条产出改写计划，内存占用与文件大小无关。
+    源文件开头的 UTF-8 BOM 会被去掉。
+    progress(done, total) 在每条语句解析完成后调用，由于事先不知道语句总数，total 为 None。
+    cancel_event 被设置时抛出 GenerationCancelled。
+    on_error 见 ON_ERROR_POLICIES：abort 时抛出第一个 SqlSyntaxError，skip / passthrough 时把错误追加到 errors 中。
+    错误的行列号已换算为源文件中的位置。
+    byte_progress(bytes_read, file_size) 在每条语句解析完成后调用，用于按已读取的字节数显示进度。
+    """
+    with open(input_path, "r", encoding="utf-8-sig") as f:
+        if byte_progress is not None:
+            # 文本层的 tell() 需要重建解码器状态，开销较大；底层二进制流的位置足以表示进度
+            file_size = os.fstat(f.fileno()).st_size
+            statement_progress = progress
+
+            def progress(done, total):
+                if statement_progress is not None:
+                    statement_progress(done, total)
+                byte_progress(f.buffer.tell(), file_size)
+
+        yield from _iter_located_plans(iter_sql_statements_with_positions(f), workers, progress,
+                                       cancel_event, on_error, errors)
+
+
+def _iter_located_plans(positioned, workers, progress, cancel_event, on_error, errors):
+    # 语句交给 iter_rewrite_plans 时记下位置，计划按相同顺序产出，只需保留在途语句的位置
+    pending = deque()
+
+    def statements():
+        for item in positioned:
+            pending.append(item)
+            yield item[2]
+
+    for index, plan in enumerate(iter_rewrite_plans(statements(), workers, strict=on_error != "recover")):
+        check_cancelled(cancel_event)
+        line, column, statement = pending.popleft()
+        if isinstance(plan, SqlSyntaxError):
+            error = plan.located(index, line, column)
+            if on_error == "abort":
+                raise error
+            if errors is not None:
+                errors.append(error)
+            if on_error == "passthrough":
+                yield RewritePlan(statement, ())
+        else:
+            yield plan
+        if progress is not None:
+            progress(index + 1, None)
+
+
+def read_script_plan(input_path: str, strict: bool = False) -> RewritePlan:
+    """
+    整文件模式：读入整个源文件并一次解析，返回针对整个脚本的改写计划。
+    不转换换行符，去掉开头的 UTF-8 BOM 后计划中的位置与源文件中的字符一一对应。
+    strict=True 时遇到语法错误抛出 SqlSyntaxError，行列号即源文件中的位置。
+    """
+    with open(input_path, "r", encoding="utf-8-sig", newline="") as f:
+        script = f.read()
+    return build_script_rewrite_plan(script, strict)
+
+
+@contextmanager
+def _atomic_output(output_path: str, mode: str = "w"):
+    """
+    写入同目录下的临时文件，正常结束后替换为 output_path；出错或取消时删除临时文件，已有的输出文件保持不变。
+    """
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode, encoding=None if "b" in mode else "utf-8") as out:
+            yield out
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def _atomic_outputs(output_paths, mode: str = "w"):
+    """
+    同时写入多个文件：各自写入同目录下的临时文件，全部写完后才依次替换目标文件。
+    替换中途失败时已替换的文件恢复为原来的内容（原来不存在的删除），因此要么全部生成，要么都保持不变。
+    """
+    tmp_paths = [f"{path}.{os.getpid()}.tmp" for path in output_paths]
+    try:
+        with ExitStack() as stack:
+            yield [stack.enter_context(open(tmp_path, mode, encoding=None if "b" in mode else "utf-8"))
+                   for tmp_path in tmp_paths]
+        _replace_all(tmp_paths, output_paths)
+    finally:
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _replace_all(tmp_paths, output_paths):
+    # 已有的目标文件先移到备份文件，全部替换成功后再删除备份
+    replaced = []
+    try:
+        for tmp_path, output_path in zip(tmp_paths, output_paths):
+            backup_path = None
+            if os.path.exists(output_path):
+                backup_path = f"{output_path}.{os.getpid()}.bak"
+                os.replace(output_path, backup_path)
+            replaced.append((output_path, backup_path))
+            os.replace(tmp_path, output_path)
+    except BaseException:
+        for output_path, backup_path in reversed(replaced):
+            try:
+                if backup_path is not None:
+                    os.replace(backup_path, output_path)
+                elif os.path.exists(output_path):
+                    os.remove(output_path)
+            except OSError:
+                pass
+        raise
+    for _, backup_path in replaced:
+        if backup_path is not None:
+            try:
+                os.remove(backup_path)
+            except OSError:
+                pass
+
+
+def _utf8_offsets(text: str, positions) -> list[int]:
+    """
+    把升序排列的字符位置换算为 UTF-8 编码后的字节偏移。
+    """
+    if text.isascii():
+        return list(positions)
+    offsets = []
+    pos = byte_pos = 0
+    for position in positions:
+        while pos < position:
+            step = min(position, pos + _ENCODE_CHUNK_SIZE)
+            byte_pos += len(text[pos:step].encode("utf-8"))
+            pos = step
+        offsets.append(byte_pos)
+    return offsets
+
+
+def write_script_sql(input_path: str, output_path: str, plan: RewritePlan, schemas, cancel_event=None):
+    """
+    把整个脚本依次应用到每个 schema 并写入目标文件，语句之间的注释和格式原样保留。
+    脚本最后一条语句没有分号时补上，避免与下一个 schema 的第一条语句连在一起。
+
+    plan 须由 read_script_plan(input_path) 得到。未改动的部分直接从源文件的 mmap 写出，只插入带 schema 的表名，
+    不在内存中拼接改写后的脚本；输出先写入临时文件，全部成功后才替换目标文件。
+    """
+    with _mapped_script_writer(input_path, plan) as write, _atomic_output(output_path, "wb") as out:
+        for schema in schemas:
+            check_cancelled(cancel_event)
+            write(out, schema)
+
+
+def write_script_schema_files(input_path: str, plan: RewritePlan, schemas, cancel_event=None) -> list[str]:
+    """
+    整文件模式下每个 schema 写入单独的 <stem>_<schema>.sql，各文件在线程池中并行写出，共用同一个 mmap。
+    返回输出文件路径列表；任一文件写入或替换失败时所有文件都不会生成，已有的输出文件保持不变。
+    """
+    schemas = list(schemas)
+    output_paths = [schema_output_path_for(input_path, schema) for schema in schemas]
+    with _mapped_script_writer(input_path, plan) as write, _atomic_outputs(output_paths, "wb") as outputs:
+        with ThreadPoolExecutor(max_workers=max(1, min(len(schemas), _OUTPUT_THREADS))) as executor:
+            futures = []
+            for schema, out in zip(schemas, outputs):
+                check_cancelled(cancel_event)
+                futures.append(executor.submit(write, out, schema))
+            for future in futures:
+                future.result()
+    return output_paths
+
+
+@contextmanager
+def _mapped_script_writer(input_path: str, plan: RewritePlan):
+    """
+    映射源文件，产出 write(out, schema)：把应用到 schema 后的整个脚本写入二进制文件对象 out，可在多个线程中同时调用。
+    源文件开头有 UTF-8 BOM 时（read_script_plan 已去掉），字节偏移从 BOM 之后算起，输出中不含 BOM。
+    """
+    script = plan.sql
+    edits = sorted(plan.replacements)
+    content_end = len(script.rstrip())
+    offsets = _utf8_offsets(script, [p for start, stop, _ in edits for p in (start, stop + 1)]
+                            + [content_end, len(script)])
+    script_size = offsets.pop()
+    content_end = offsets.pop()
+    terminator = b"" if script_ends_with_terminator(script) else b"\n;"
+
+    with open(input_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        # 空文件无法 mmap
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if file_size else b""
+        bom = len(codecs.BOM_UTF8) if source[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8 else 0
+        if file_size != bom + script_size:
+            if file_size:
+                source.close()
+            raise OSError(f"{input_path} 在解析之后被修改")
+        offsets = [offset + bom for offset in offsets]
+        content_end += bom
+        view = memoryview(source)
+        timings = get_phase_timings()
+
+        def write(out, schema):
+            started = time.perf_counter()
+            pos = bom
+            for (_, _, table_name), start, stop in zip(edits, offsets[::2], offsets[1::2]):
+                out.write(view[pos:start])
+                out.write(f"{schema}.{table_name}".encode("utf-8"))
+                pos = stop
+            out.write(view[pos:content_end])
+            out.write(terminator + b"\n\n")
+            if timings is not None:
+                timings.add("splice", time.perf_counter() - started)
+
+        try:
+            yield write
+        finally:
+            view.release()
+            if file_size:
+                source.close()
+
+
+def write_generated_sql(output_path: str, plans, schemas, cancel_event=None):
+    """
+    把改写计划依次应用到每个 schema 并写入目标文件。plans 可以是流式产出计划的迭代器，只遍历一次。
+
+    输出按 schema 分段，第一个 schema 直接写入临时输出文件，其余 schema 各写一个临时分段文件，
+    遍历结束后按顺序追加，因此内存占用与文件大小无关。全部成功后才替换目标文件，
+    中途出错或取消时已有的输出文件保持不变。
+    """
+    schemas = list(schemas)
+    with _atomic_output(output_path) as out:
+        segments = [tempfile.TemporaryFile("w+", encoding="utf-8", dir=os.path.dirname(os.path.abspath(output_path)))
+                    for _ in schemas[1:]]
+        try:
+            targets = [out] + segments
+            for plan in plans:
+                check_cancelled(cancel_event)
+                for schema, target in zip(schemas, targets):
+                    target.write(plan.apply(schema).strip() + ";\n\n")
+            for segment in segments:
+                check_cancelled(cancel_event)
+                segment.seek(0)
+                shutil.copyfileobj(segment, out)
+        finally:
+            for segment in segments:
+                segment.close()
+
+
+def write_schema_files(input_path: str, plans, schemas, cancel_event=None) -> list[str]:
+    """
+    每个 schema 写入单独的 <stem>_<schema>.sql，返回输出文件路径列表。plans 只遍历一次，可以是流式迭代器。
+    计划按批分发到线程池，每个 schema 同时最多有一批在写，写文件与后续语句的解析重叠进行；
+    各文件先写入临时文件，全部成功后才替换，任一文件写入或替换失败、或者取消时所有文件都不会生成，已有的输出文件保持不变。
+    """
+    schemas = list(schemas)
+    output_paths = [schema_output_path_for(input_path, schema) for schema in schemas]
+    plans = iter(plans)
+    with _atomic_outputs(output_paths) as outputs:
+        with ThreadPoolExecutor(max_workers=max(1, min(len(schemas), _OUTPUT_THREADS))) as executor:
+            pending = [None] * len(schemas)
+            while True:
+                batch = list(islice(plans, _PARALLEL_BATCH_SIZE))
+                if not batch:
+                    break
+                check_cancelled(cancel_event)
+                for i, (schema, out) in enumerate(zip(schemas, outputs)):
+                    # 同一文件的批次必须按顺序写入
+                    if pending[i] is not None:
+                        pending[i].result()
+                    pending[i] = executor.submit(_write_plans, out, batch, schema)
+            for future in pending:
+                if future is not None:
+                    future.result()
+    return output_paths
+
+
+def _write_plans(out, plans, schema):
+    out.writelines(plan.apply(schema).strip() + ";\n\n" for plan in plans)
+
+
+def generate_sql_file(input_path: str, schemas, workers: int = 1, on_error: str = "recover",
+                      errors: list = None, whole_file: bool = False, progress=None) -> str:
+    """
+    为源文件中的所有语句添加 schema 前缀，写入 <stem>_generated.sql，返回输出文件路径。
+    语句边读边解析边写出，输出先写入临时文件，全部成功后才替换目标文件。
+    whole_file=True 时整个文件只解析一次并保留原有格式和注释，此时忽略 workers 和 progress，
+    on_error 只支持 recover 和 abort。progress 见 iter_file_rewrite_plans。
+    """
+    output_path = output_path_for(input_path)
+    if whole_file:
+        if on_error not in ("recover", "abort"):
+            raise ValueError(f"整文件模式不支持 on_error={on_error!r}")
+        plan = read_script_plan(input_path, strict=on_error == "abort")
+        write_script_sql(input_path, output_path, plan, schemas)
+        return output_path
+
+    plans = iter_file_rewrite_plans(input_path, workers, progress, on_error=on_error, errors=errors)
+    write_generated_sql(output_path, plans, schemas)
+    return output_path
+
+
+def generate_schema_files(input_path: str, schemas, workers: int = 1, on_error: str = "recover",
+                          errors: list = None, whole_file: bool = False, progress=None) -> list[str]:
+    """
+    与 generate_sql_file 相同，但源文件只解析一次，每个 schema 写入单独的 <stem>_<schema>.sql，返回输出文件路径列表。
+    """
+    if whole_file:
+        if on_error not in ("recover", "abort"):
+            raise ValueError(f"整文件模式不支持 on_error={on_error!r}")
+        plan = read_script_plan(input_path, strict=on_error == "abort")
+        return write_script_schema_files(input_path, plan, schemas)
+
+    plans = iter_file_rewrite_plans(input_path, workers, progress, on_error=on_error, errors=errors)
+    return write_schema_files(input_path, plans, schemas)
@@ -1,57 +1,1037 @@
+import atexit
+import io
+import re
+import threading
+import time
+from contextlib import contextmanager
 from functools import lru_cache
+from typing import NamedTuple
 
 from antlr4.InputStream import InputStream
+from antlr4.Token import Token
 from antlr4.CommonTokenStream import CommonTokenStream
-from antlr4.tree.Tree import ParseTreeWalker
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.dfa.DFA import DFA
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import InputMismatchException, NoViableAltException, ParseCancellationException
 
-import sqlglot
+from parse_cache import DEFAULT_MAX_ENTRIES, ParseCache
 
-from MySqlLexer import MySqlLexer
-from MySqlParser import MySqlParser
-from schema_modifier_listener import SchemaModifierListener
+# 生成的词法/语法模块体积很大，导入时要反序列化 ATN（耗时 1~2 秒），
+# 因此延迟到第一次使用时由 load_grammar() 加载
+MySqlLexer = None
+MySqlParser = None
+TableNameCollectingParser = None
+_grammar_lock = threading.Lock()
 
 
-def split_sql_statements(sql_content):
+def load_grammar():
+    """
+    导入 MySqlLexer / MySqlParser 并初始化词法快速路径用到的 token 集合。
+    首次使用解析功能时会自动调用；也可以在后台线程中提前调用，预热解析器。
+    """
+    global MySqlLexer, MySqlParser, TableNameCollectingParser
+    if MySqlParser is not None:
+        return
+    with _grammar_lock:
+        if MySqlParser is not None:
+            return
+        from MySqlLexer import MySqlLexer as lexer_class
+        from MySqlParser import MySqlParser as parser_class
+        from schema_modifier_listener import TableNameCollectingParser as collecting_parser_class
+
+        MySqlLexer = lexer_class
+        TableNameCollectingParser = collecting_parser_class
+        _init_token_sets()
+        # MySqlParser 最后赋值，作为加载完成的标志
+        MySqlParser = parser_class
+
+
+class ParseStats:
+    """
+    统计实际分析的语句数、其中仅靠词法快速路径识别的语句数，
+    以及 SLL 失败、需要回退到完整 LL 的语句数。命中缓存的语句不计入。
+    syntax_errors 为存在语法错误（经过错误恢复或在严格模式下报错）的语句数，dfa_resets 为按 DfaLimits 清空 DFA 的次数。
+    bulk_inserts 为只分析语句开头、VALUES 部分原样保留的批量 INSERT 语句数（同时计入 statements 和 fast_path）。
+    """
+
+    def __init__(self):
+        self.statements = 0
+        self.fast_path = 0
+        self.bulk_inserts = 0
+        self.ll_fallbacks = 0
+        self.syntax_errors = 0
+        self.dfa_resets = 0
+
+    @property
+    def fallback_ratio(self) -> float:
+        return self.ll_fallbacks / self.statements if self.statements else 0.0
+
+    def __repr__(self):
+        return (f"ParseStats(statements={self.statements}, fast_path={self.fast_path}, bulk_inserts={self.bulk_inserts}, "
+                f"ll_fallbacks={self.ll_fallbacks}, "
+                f"fallback_ratio={self.fallback_ratio:.2%}, syntax_errors={self.syntax_errors}, "
+                f"dfa_resets={self.dfa_resets})")
+
+
+_parse_stats = ParseStats()
+
+
+def get_parse_stats() -> ParseStats:
+    return _parse_stats
+
+
+def reset_parse_stats():
+    _parse_stats.statements = 0
+    _parse_stats.fast_path = 0
+    _parse_stats.bulk_inserts = 0
+    _parse_stats.ll_fallbacks = 0
+    _parse_stats.syntax_errors = 0
+    _parse_stats.dfa_resets = 0
+
+
+# 各阶段名称及显示顺序
+PHASES = ("split", "lex", "fast_path", "parse", "extract", "splice")
+
+
+class PhaseTimings:
+    """
+    各阶段的累计耗时（秒）和次数：
+    split 切分语句，lex 单条语句词法分析，fast_path 词法快速路径匹配，
+    parse SLL/LL 语法分析，extract 提取表名位置，splice 把改写计划应用到 schema。
+    按 schema 输出多个文件时多个写线程会同时累加 splice，add 需要加锁。
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float, count: int = 1):
+        with self._lock:
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+            self.counts[phase] = self.counts.get(phase, 0) + count
+
+    def lap(self, phase: str, started: float) -> float:
+        """
+        把 started 至今的耗时计入 phase，返回当前时间，便于连续计时下一个阶段。
+        """
+        now = time.perf_counter()
+        self.add(phase, now - started)
+        return now
+
+    @property
+    def total(self) -> float:
+        return sum(self.seconds.values())
+
+    def summary(self) -> str:
+        total = self.total
+        lines = [f"{'phase':<10}{'count':>10}{'seconds':>10}{'share':>8}"]
+        for phase, seconds in self.seconds.items():
+            share = seconds / total if total else 0.0
+            lines.append(f"{phase:<10}{self.counts[phase]:>10}{seconds:>10.3f}{share:>8.1%}")
+        lines.append(f"{'total':<10}{'':>10}{total:>10.3f}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "PhaseTimings(" + ", ".join(f"{phase}={seconds:.3f}s" for phase, seconds in self.seconds.items()) + ")"
+
+
+# 为 None 时各阶段只多一次全局变量判断，不调用计时函数
+_phase_timings: PhaseTimings | None = None
+
+
+@contextmanager
+def collect_phase_timings(timings: PhaseTimings = None):
+    """
+    在 with 块内统计各阶段耗时，产出 PhaseTimings；可以传入已有的实例继续累加。
+    统计是进程级的，并行模式下子进程中的词法/语法分析不会计入。
+    """
+    global _phase_timings
+    previous = _phase_timings
+    _phase_timings = timings if timings is not None else PhaseTimings()
+    try:
+        yield _phase_timings
+    finally:
+        _phase_timings = previous
+
+
+def get_phase_timings() -> PhaseTimings | None:
+    return _phase_timings
+
+
+# 可选的持久化解析缓存，默认关闭
+_persistent_cache: ParseCache | None = None
+
+
+def enable_parse_cache(path: str = None, max_entries: int = DEFAULT_MAX_ENTRIES) -> ParseCache:
+    """
+    启用持久化解析缓存。path 为空时使用用户缓存目录，命中时完全跳过词法和语法分析。
+    """
+    global _persistent_cache
+    disable_parse_cache()
+    _persistent_cache = ParseCache(path, max_entries)
+    return _persistent_cache
+
+
+def disable_parse_cache():
+    global _persistent_cache
+    if _persistent_cache is not None:
+        _persistent_cache.close()
+        _persistent_cache = None
+
+
+def get_parse_cache() -> ParseCache | None:
+    return _persistent_cache
+
+
+# 为 True 时不查询也不写入 LRU 缓存和持久化缓存
+_caches_bypassed = False
+
+
+@contextmanager
+def caches_disabled():
+    """
+    在 with 块内绕过 LRU 缓存和持久化缓存，每条语句都重新分析，用于基准测试和性能剖析；缓存中已有的内容保持不变。
+    与 collect_phase_timings 一样是进程级的设置。
+    """
+    global _caches_bypassed
+    previous = _caches_bypassed
+    _caches_bypassed = True
+    try:
+        yield
+    finally:
+        _caches_bypassed = previous
+
+
+def flush_parse_cache():
+    if _persistent_cache is not None:
+        _persistent_cache.flush()
+
+
+atexit.register(disable_parse_cache)
+
+
+# 流式切分时每次从文件读取的字符数
+_SPLIT_CHUNK_SIZE = 64 * 1024
+
+# 以下 token 集合依赖 MySqlLexer，由 load_grammar() 初始化
+# 出现在缓冲区中时说明可能有跨越缓冲区末尾、尚未闭合的字符串或注释，其后的分号不可信
+_UNTERMINATED_TOKENS: set[int] = set()
+
+
+def iter_sql_statements(source, chunk_size: int = _SPLIT_CHUNK_SIZE):
+    """
+    使用 MySqlLexer 按默认通道上的分号流式切分 SQL，逐条产出语句原文（不含分号及前后的空白、注释）。
+    source 可以是字符串或文本文件对象；文件按块读取，内存占用取决于最长的语句而不是整个文件。
+    """
+    for _, _, statement in iter_sql_statements_with_positions(source, chunk_size):
+        yield statement
+
+
+def iter_sql_statements_with_positions(source, chunk_size: int = _SPLIT_CHUNK_SIZE):
+    """
+    与 iter_sql_statements 相同，但产出 (行号, 列号, 语句原文)，
+    即语句第一个 token 在源文件中的位置（行从 1 开始，列从 0 开始，与 ANTLR 一致）。
+    """
+    load_grammar()
+    if isinstance(source, str):
+        source = io.StringIO(source)
+
+    buffer = ""
+    # 缓冲区开头在源文件中的行号和列号
+    base_line = 1
+    base_column = 0
+    # 缓冲区中没有可切分的语句时，等缓冲区增长一倍再重新分词，避免超长语句被反复分词
+    next_lex_size = 0
+    while True:
+        chunk = source.read(chunk_size)
+        at_eof = not chunk
+        buffer += chunk
+        if not at_eof and (";" not in chunk or len(buffer) < next_lex_size):
+            continue
+
+        timings = _phase_timings
+        if timings is not None:
+            started = time.perf_counter()
+        statements = []
+        # 缓冲区开头的批量 INSERT 直接用正则切分，数 MB 的 VALUES 部分不经过词法分析
+        spans, consumed, need_more = _split_bulk_inserts(buffer, at_eof)
+        for start, stop in spans:
+            line, column = _offset_position(buffer, start, base_line, base_column)
+            statements.append((line, column, buffer[start:stop].rstrip()))
+        if consumed:
+            base_line, base_column = _offset_position(buffer, consumed, base_line, base_column)
+            buffer = buffer[consumed:]
+            consumed = 0
+
+        if not need_more:
+            lexer = MySqlLexer(InputStream(buffer))
+            lexer.removeErrorListeners()
+            tokens = lexer.getAllTokens()
+
+            statement_tokens = []
+            for i, token in enumerate(tokens):
+                if not at_eof and _is_unterminated(tokens, i):
+                    break
+                if token.type == MySqlLexer.SEMI and token.channel == Token.DEFAULT_CHANNEL:
+                    statement = _statement(buffer, statement_tokens, base_line, base_column)
+                    if statement:
+                        statements.append(statement)
+                    statement_tokens = []
+                    consumed = token.stop + 1
+                else:
+                    statement_tokens.append(token)
+            if at_eof:
+                statement = _statement(buffer, statement_tokens, base_line, base_column)
+                if statement:
+                    statements.append(statement)
+        if timings is not None:
+            timings.add("split", time.perf_counter() - started, len(statements))
+
+        yield from statements
+        if at_eof:
+            return
+
+        base_line, base_column = _offset_position(buffer, consumed, base_line, base_column)
+        buffer = buffer[consumed:]
+        next_lex_size = 0 if consumed else len(buffer) * 2
+
+
+def _offset_position(buffer: str, offset: int, base_line: int, base_column: int) -> tuple[int, int]:
+    """
+    缓冲区中 offset 处在源文件中的行号和列号，base_line / base_column 为缓冲区开头的位置。
+    """
+    newlines = buffer.count("\n", 0, offset)
+    if newlines:
+        return base_line + newlines, offset - buffer.rfind("\n", 0, offset) - 1
+    return base_line, base_column + offset
+
+
+def _split_bulk_inserts(buffer: str, at_eof: bool) -> tuple[list[tuple[int, int]], int, bool]:
+    """
+    从缓冲区开头连续切出 VALUES 部分只含字面量的 INSERT 语句，返回 (各语句的起止位置, 已消费的字符数, 是否需要读入更多数据)。
+    遇到其他语句时停止，剩余部分交给词法分析切分。
+    """
+    spans = []
+    consumed = 0
+    while True:
+        start = _WHITESPACE.match(buffer, consumed).end()
+        head = _BULK_INSERT_HEAD.match(buffer, start)
+        if head is None:
+            return spans, consumed, False
+        stop = _BULK_VALUES_BODY.match(buffer, head.end()).end()
+        if stop < len(buffer) and buffer[stop] == ";":
+            spans.append((start, stop))
+            consumed = stop + 1
+        elif at_eof:
+            if stop == len(buffer):
+                spans.append((start, stop))
+                consumed = stop
+            return spans, consumed, False
+        else:
+            # 语句还没有读完，或者停在跨越缓冲区末尾、尚未闭合的字符串上
+            return spans, consumed, stop == len(buffer) or buffer[stop] in "'\""
+
+
+def _is_unterminated(tokens, i: int) -> bool:
+    token = tokens[i]
+    if token.type in _UNTERMINATED_TOKENS:
+        return True
+    # 未闭合的 /* 注释会被拆成 '/' 和 '*' 两个相邻 token
+    return (token.type == MySqlLexer.DIVIDE and i + 1 < len(tokens)
+            and tokens[i + 1].type == MySqlLexer.STAR and tokens[i + 1].start == token.stop + 1)
+
+
+def _statement(buffer: str, tokens, base_line: int, base_column: int) -> tuple[int, int, str] | None:
+    significant = [token for token in tokens if token.channel != Token.HIDDEN_CHANNEL]
+    if not significant:
+        return None
+    first = significant[0]
+    column = first.column + base_column if first.line == 1 else first.column
+    return base_line + first.line - 1, column, buffer[first.start:significant[-1].stop + 1]
+
+
+# 最后一行出现这些字符时，末尾的分号可能位于注释或字符串中
+_TAIL_AMBIGUOUS_MARKERS = ("--", "#", "/*", "*/", "'", '"', "`")
+
+
+def script_ends_with_terminator(script: str) -> bool:
+    """
+    脚本最后一条语句是否以分号结束（脚本为空时也视为已结束）。
+    通常只需检查末尾字符；最后一行有注释或引号时才对整个脚本做词法分析确认。
+    """
+    tail = script.rstrip()
+    if not tail:
+        return True
+    last_line = tail[tail.rfind("\n") + 1:]
+    if not any(marker in last_line for marker in _TAIL_AMBIGUOUS_MARKERS):
+        return tail.endswith(";")
+
+    load_grammar()
+    lexer = MySqlLexer(InputStream(script))
+    lexer.removeErrorListeners()
+    last = None
+    for token in lexer.getAllTokens():
+        if token.channel == Token.DEFAULT_CHANNEL:
+            last = token
+    return last is None or last.type == MySqlLexer.SEMI
+
+
+def split_sql_statements(sql_content, pretty: bool = False):
+    """
+    切分 SQL 语句。默认只用词法分析查找语句边界，语句原文逐字保留；
+    pretty=True 时改用 sqlglot 完整解析并重新生成格式化后的 SQL（会额外多一遍解析，且丢弃注释）。
+    """
+    if not pretty:
+        return list(iter_sql_statements(sql_content))
+
+    import sqlglot
+
+    timings = _phase_timings
+    if timings is not None:
+        started = time.perf_counter()
     # 使用sqlglot自带的split方法，能正确处理分号、字符串、注释等
     statements = []
     for stmt in sqlglot.transpile(sql_content, read="mysql", pretty=True, comments=False):
         s = stmt.strip()
         if s:
             statements.append(s)
+    if timings is not None:
+        timings.add("split", time.perf_counter() - started, len(statements))
     return statements
 
+
+class RewritePlan(NamedTuple):
+    """
+    单条 SQL 的改写计划：原始语句及其中需要添加 schema 的表名位置。
+    语句只需解析一次，之后可以反复应用到任意多个 schema。
+    """
+    sql: str
+    replacements: tuple[tuple[int, int, str], ...]
+
+    def apply(self, schema: str) -> str:
+        if not self.replacements:
+            return self.sql
+        timings = _phase_timings
+        if timings is None:
+            return splice(self.sql, [(start, stop, f"{schema}.{table_name}")
+                                     for start, stop, table_name in self.replacements])
+        started = time.perf_counter()
+        sql = splice(self.sql, [(start, stop, f"{schema}.{table_name}")
+                                for start, stop, table_name in self.replacements])
+        timings.lap("splice", started)
+        return sql
+
+
+def splice(text: str, edits) -> str:
+    """
+    按偏移量改写文本。edits 为 (start, stop, replacement)，stop 为包含端点（与 ANTLR token 一致），
+    区间之间不能重叠。未改动的片段和替换内容先收集起来，最后只 join 一次。
+    """
+    pieces = []
+    pos = 0
+    for start, stop, replacement in sorted(edits):
+        if start < pos:
+            raise ValueError(f"改写区间重叠: {start} < {pos}")
+        pieces.append(text[pos:start])
+        pieces.append(replacement)
+        pos = stop + 1
+    pieces.append(text[pos:])
+    return "".join(pieces)
+
+
+class SqlSyntaxError(Exception):
+    """
+    严格模式下语句无法解析时抛出。line / column 为出错 token 的位置（行从 1 开始，列从 0 开始）：
+    由 build_rewrite_plan 抛出时相对于语句本身，由 sql_generator 读取文件时已换算为源文件中的位置。
+    statement_index 为语句在文件中的序号（从 0 开始），单独解析一条语句时为 None。
+    """
+
+    def __init__(self, message: str, line: int, column: int, offending_token: str, sql: str = None,
+                 statement_index: int = None):
+        super().__init__(message)
+        self.message = message
+        self.line = line
+        self.column = column
+        self.offending_token = offending_token
+        self.sql = sql
+        self.statement_index = statement_index
+
+    def __reduce__(self):
+        # 并行模式下需要从子进程传回主进程
+        return type(self), (self.message, self.line, self.column, self.offending_token, self.sql,
+                            self.statement_index)
+
+    def located(self, statement_index: int, line: int, column: int) -> "SqlSyntaxError":
+        """
+        根据语句在源文件中的起始位置 (line, column) 换算出错位置，返回新的异常。
+        """
+        return SqlSyntaxError(
+            self.message,
+            line + self.line - 1,
+            self.column + column if self.line == 1 else self.column,
+            self.offending_token,
+            self.sql,
+            statement_index,
+        )
+
+    def __str__(self):
+        where = f"第 {self.statement_index + 1} 条语句，" if self.statement_index is not None else ""
+        return f"{where}第 {self.line} 行第 {self.column + 1} 列 {self.offending_token!r} 附近有语法错误：{self.message}"
+
+
+def build_rewrite_plan(sql: str, strict: bool = False) -> RewritePlan:
+    """
+    解析 SQL 并生成改写计划。
+    strict=True 时遇到第一个语法错误即停止并抛出 SqlSyntaxError，而不是经错误恢复后继续改写；
+    此时不走词法快速路径，每条语句都经过完整的语法分析。
+    """
+    return RewritePlan(sql, _statement_replacements(sql, strict))
+
+
+def build_script_rewrite_plan(script: str, strict: bool = False) -> RewritePlan:
+    """
+    不切分语句，用 root 规则以 SLL 把整个脚本一次解析完，表名位置相对于整个脚本；
+    apply(schema) 一次拼接出整个脚本的改写结果，语句之间的注释和原有格式全部保留。
+    不经过 LRU 缓存以免长期持有整个脚本；启用持久化缓存时按整个脚本缓存。
+    strict=True 时 SqlSyntaxError 的行列号为脚本中的位置。
+    """
+    return RewritePlan(script, _lookup_replacements(script, strict, _analyze_script))
+
+
 def add_schema_to_sql(sql, schema):
     """
     使用 ANTLR MySQL 解析器解析 SQL，并在表名前添加 schema 前缀。
     """
-    replacements = _get_table_replacements(sql)
+    return build_rewrite_plan(sql).apply(schema)
 
-    if not replacements:
-        return sql
 
-    # 从后往前替换，避免索引错位
-    result = sql
-    for start, stop, table_name in sorted(replacements, key=lambda x: -x[0]):
-        result = result[:start] + f"{schema}.{table_name}" + result[stop + 1:]
-    return result
+def _statement_replacements(sql: str, strict: bool = False) -> tuple[tuple[int, int, str], ...]:
+    # 批量 INSERT 不进入 LRU 和持久化缓存：语句很长且几乎不会重复，缓存只会长期占用内存
+    # 严格模式不走快速路径：快速路径只检查语句开头，无法发现后面的语法错误
+    replacements = None if strict else _match_bulk_insert(sql)
+    if replacements is None:
+        replacements = _lookup_replacements(sql, strict) if _caches_bypassed else _get_table_replacements(sql, strict)
+    return replacements
 
 
 @lru_cache(maxsize=256)
-def _get_table_replacements(sql: str) -> tuple[tuple[int, int, str], ...]:
+def _get_table_replacements(sql: str, strict: bool = False) -> tuple[tuple[int, int, str], ...]:
     """
     解析 SQL，返回所有需要添加 schema 的表的起止位置及原始表名。
-    结果使用 LRU 缓存，避免对相同 SQL 重复解析。
+    结果使用 LRU 缓存，避免对相同 SQL 重复解析；启用持久化缓存时先查询持久化缓存。
+    """
+    return _lookup_replacements(sql, strict)
+
+
+def _lookup_replacements(sql: str, strict: bool, analyze=None) -> tuple[tuple[int, int, str], ...]:
+    analyze = analyze or _analyze_statement
+    cache = _persistent_cache
+    if cache is None or _caches_bypassed:
+        return analyze(sql, strict=strict)
+
+    replacements = cache.get(sql)
+    if replacements is None:
+        syntax_errors = _parse_stats.syntax_errors
+        fast_path = _parse_stats.fast_path
+        replacements = analyze(sql, strict=strict)
+        # 经过错误恢复或快速路径得到的结果不写入持久化缓存，否则严格模式命中缓存后会跳过语法检查
+        if _parse_stats.syntax_errors == syntax_errors and _parse_stats.fast_path == fast_path:
+            cache.put(sql, replacements)
+    return replacements
+
+
+def _analyze_statement(sql: str, listener=None, strict: bool = False) -> tuple[tuple[int, int, str], ...]:
+    """
+    对单条语句做词法分析、快速路径匹配（strict=True 时跳过）和语法分析，不经过任何缓存。
+    listener 为可选的 ErrorListener，会挂到语法分析器上，用于统计预测过程（见 parse_profiler）。
+    """
+    load_grammar()
+    timings = _phase_timings
+    if timings is not None:
+        started = time.perf_counter()
+    token_stream = _parsing_context().tokenize(sql)
+    if timings is not None:
+        started = timings.lap("lex", started)
+
+    _parse_stats.statements += 1
+    if not strict:
+        replacements = _match_simple_statement(token_stream.tokens)
+        if timings is not None:
+            started = timings.lap("fast_path", started)
+        if replacements is not None:
+            _parse_stats.fast_path += 1
+            return replacements
+
+    try:
+        parser = _parse_root(token_stream, listener, strict)
+    except SqlSyntaxError as e:
+        e.sql = sql
+        raise
+    if timings is not None:
+        started = timings.lap("parse", started)
+    replacements = tuple(parser.table_replacements())
+    if timings is not None:
+        timings.lap("extract", started)
+    if _dfa_limits is not None:
+        _check_dfa_limits(_dfa_limits)
+    return replacements
+
+
+class _ParsingContext:
+    """
+    每个线程复用的一组词法/语法分析器。每条语句只替换输入并重置状态，不再重新构造；
+    默认的控制台错误监听器全部移除，语法错误由错误恢复策略处理，不输出到控制台。
+    """
+
+    def __init__(self):
+        self.lexer = MySqlLexer(None)
+        self.lexer.removeErrorListeners()
+        self.token_stream = CommonTokenStream(self.lexer)
+
+        self.sll_parser = TableNameCollectingParser(None)
+        self.sll_parser._interp.predictionMode = PredictionMode.SLL
+        self.sll_parser._errHandler = BailErrorStrategy()
+        self.sll_parser.removeErrorListeners()
+
+        self.ll_parser = TableNameCollectingParser(None)
+        self.ll_parser._interp.predictionMode = PredictionMode.LL
+        self.ll_parser.removeErrorListeners()
+        self.recovering_strategy = DefaultErrorStrategy()
+        self.bail_strategy = BailErrorStrategy()
+
+    def tokenize(self, sql: str) -> CommonTokenStream:
+        self.lexer.inputStream = InputStream(sql)
+        self.token_stream.setTokenSource(self.lexer)
+        self.token_stream.fill()
+        return self.token_stream
+
+
+_local = threading.local()
+
+
+def _parsing_context() -> _ParsingContext:
+    context = getattr(_local, "parsing_context", None)
+    if context is None:
+        context = _local.parsing_context = _ParsingContext()
+    return context
+
+
+def _parse_root(token_stream: CommonTokenStream, listener=None, strict: bool = False) -> "TableNameCollectingParser":
+    """
+    两阶段解析：先用 SLL + BailErrorStrategy 快速尝试，绝大多数普通 DML/DDL 在这一步即可完成；
+    只有 SLL 失败时才回退到完整 LL 预测和默认的错误恢复。返回已完成解析、记录了表名的解析器，
+    解析器属于当前线程的 _ParsingContext，下一次解析时会被重置。
+    strict=True 时 LL 阶段同样使用 BailErrorStrategy，仍然失败说明确实存在语法错误，抛出 SqlSyntaxError。
+    """
+    parser = _parse_sll(token_stream, listener)
+    if parser is not None:
+        return parser
+
+    context = _parsing_context()
+    _parse_stats.ll_fallbacks += 1
+    token_stream.seek(0)
+    parser = context.ll_parser
+    parser._errHandler = context.bail_strategy if strict else context.recovering_strategy
+    parser.setTokenStream(token_stream)
+    if listener is not None:
+        parser.addErrorListener(listener)
+    try:
+        parser.root()
+    except ParseCancellationException as e:
+        _parse_stats.syntax_errors += 1
+        raise _syntax_error(parser, e) from None
+    finally:
+        if listener is not None:
+            parser.removeErrorListener(listener)
+    if parser.getNumberOfSyntaxErrors():
+        _parse_stats.syntax_errors += 1
+    return parser
+
+
+def _parse_sll(token_stream: CommonTokenStream, listener=None) -> "TableNameCollectingParser | None":
+    """
+    只用 SLL + BailErrorStrategy 解析，失败时返回 None。
+    """
+    parser = _parsing_context().sll_parser
+    parser.setTokenStream(token_stream)
+    if listener is not None:
+        parser.addErrorListener(listener)
+    try:
+        parser.root()
+        return parser
+    except ParseCancellationException:
+        return None
+    finally:
+        if listener is not None:
+            parser.removeErrorListener(listener)
+
+
+def _analyze_script(script: str, strict: bool = False) -> tuple[tuple[int, int, str], ...]:
+    """
+    整个脚本先用 SLL 一次解析；失败时不对整个脚本做 LL 解析（全上下文预测可能跨越多条语句，
+    实测比逐条解析慢几十倍），而是按分号切分后逐条分析（可使用 LRU 缓存和词法快速路径），再把位置换算回脚本中。
+    """
+    load_grammar()
+    timings = _phase_timings
+    if timings is not None:
+        started = time.perf_counter()
+    token_stream = _parsing_context().tokenize(script)
+    tokens = token_stream.tokens
+    if timings is not None:
+        started = timings.lap("lex", started)
+
+    parser = _parse_sll(token_stream)
+    if parser is not None:
+        statements = sum(1 for _ in _iter_statement_tokens(tokens))
+        _parse_stats.statements += statements
+        if timings is not None:
+            started = timings.lap("parse", started)
+        replacements = tuple(parser.table_replacements())
+        if timings is not None:
+            timings.lap("extract", started)
+        if _dfa_limits is not None:
+            _check_dfa_limits(_dfa_limits, statements)
+        return replacements
+    if timings is not None:
+        timings.lap("parse", started)
+
+    replacements = []
+    for index, statement_tokens in enumerate(_iter_statement_tokens(tokens)):
+        first, last = statement_tokens[0], statement_tokens[-1]
+        try:
+            statement_replacements = _statement_replacements(script[first.start:last.stop + 1], strict)
+        except SqlSyntaxError as e:
+            raise e.located(index, first.line, first.column) from None
+        for start, stop, table_name in statement_replacements:
+            replacements.append((start + first.start, stop + first.start, table_name))
+    return tuple(replacements)
+
+
+def _iter_statement_tokens(tokens):
+    """
+    按默认通道上的分号切分 token 列表，逐条产出语句中第一个到最后一个非 HIDDEN token 组成的列表。
+    """
+    statement_tokens = []
+    for token in tokens:
+        if token.type == Token.EOF or (token.type == MySqlLexer.SEMI and token.channel == Token.DEFAULT_CHANNEL):
+            if statement_tokens:
+                yield statement_tokens
+            statement_tokens = []
+        elif token.channel != Token.HIDDEN_CHANNEL:
+            statement_tokens.append(token)
+
+
+def _syntax_error(parser, cancellation: ParseCancellationException) -> SqlSyntaxError:
+    cause = cancellation.args[0] if cancellation.args else None
+    token = getattr(cause, "offendingToken", None) or parser.getCurrentToken()
+    if isinstance(cause, NoViableAltException):
+        message = "无法识别的语法"
+    elif isinstance(cause, InputMismatchException):
+        expected = cause.getExpectedTokens().toString(parser.literalNames, parser.symbolicNames)
+        message = f"期望 {expected if len(expected) <= 120 else expected[:117] + '...'}"
+    else:
+        message = "语法错误"
+    return SqlSyntaxError(message, token.line, token.column, token.text)
+
+
+class DfaSize(NamedTuple):
+    """
+    语法/词法分析器 DFA 的状态数，以及语法分析器共享的 PredictionContextCache 条目数。
     """
-    input_stream = InputStream(sql)
-    lexer = MySqlLexer(input_stream)
-    token_stream = CommonTokenStream(lexer)
-    token_stream.fill()
+    parser_states: int
+    lexer_states: int
+    prediction_contexts: int
+
+
+def dfa_size() -> DfaSize:
+    """
+    DFA 和预测上下文缓存是类级别共享的，进程内持续增长，可用于观察内存占用。
+    """
+    load_grammar()
+    return DfaSize(
+        parser_states=sum(len(dfa.states) for dfa in MySqlParser.decisionsToDFA),
+        lexer_states=sum(len(dfa.states) for dfa in MySqlLexer.decisionsToDFA),
+        prediction_contexts=len(MySqlParser.sharedContextCache),
+    )
+
+
+# 预热 DFA 用的代表性语句，覆盖常见的 DML/DDL 结构
+WARM_UP_CORPUS = (
+    "SELECT 1 FROM dual",
+    "SELECT a.id, b.name, COUNT(*) AS cnt FROM t1 a LEFT JOIN t2 b ON a.id = b.id "
+    "WHERE a.status IN (1, 2, 3) AND b.name LIKE 'x%' GROUP BY a.id, b.name HAVING cnt > 1 ORDER BY cnt DESC LIMIT 10",
+    "SELECT * FROM t1 WHERE id IN (SELECT id FROM t2 WHERE t2.flag = 1) AND EXISTS (SELECT 1 FROM t3 WHERE t3.id = t1.id)",
+    "SELECT x.id FROM (SELECT id, SUM(amount) AS amount FROM t1 GROUP BY id) x JOIN t2 ON t2.id = x.id",
+    "SELECT id FROM t1 UNION ALL SELECT id FROM t2",
+    "INSERT INTO t1 (id, name, created_at) VALUES (1, 'a', NOW()), (2, 'b', '2024-01-01 00:00:00')",
+    "INSERT INTO t1 (id, name) SELECT id, name FROM t2 WHERE id > 10 ON DUPLICATE KEY UPDATE name = VALUES(name)",
+    "INSERT IGNORE INTO t1 SET id = 1, name = 'a'",
+    "REPLACE INTO t1 (id, name) VALUES (1, 'a')",
+    "UPDATE t1 a JOIN t2 b ON a.id = b.id SET a.name = b.name, a.updated_at = NOW() WHERE b.flag = 1",
+    "UPDATE t1 SET amount = amount * 1.1, note = CASE WHEN amount > 100 THEN 'big' ELSE 'small' END WHERE id = 1",
+    "DELETE a FROM t1 a JOIN t2 b ON a.id = b.id WHERE b.flag = 0",
+    "DELETE FROM t1 WHERE created_at < DATE_SUB(NOW(), INTERVAL 30 DAY) ORDER BY id LIMIT 100",
+    "CREATE TABLE IF NOT EXISTS t1 (id BIGINT NOT NULL AUTO_INCREMENT, name VARCHAR(255) NOT NULL DEFAULT '' COMMENT 'n', "
+    "amount DECIMAL(18, 4) NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (id), KEY idx_name (name), "
+    "CONSTRAINT fk_t1 FOREIGN KEY (id) REFERENCES t2 (id) ON DELETE CASCADE) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4",
+    "CREATE TABLE t1 LIKE t2",
+    "CREATE INDEX idx_t1_name ON t1 (name)",
+    "ALTER TABLE t1 ADD COLUMN note TEXT NULL AFTER name, MODIFY COLUMN name VARCHAR(512) NOT NULL, DROP INDEX idx_name",
+    "CREATE OR REPLACE VIEW v1 AS SELECT a.id, b.name FROM t1 a JOIN t2 b ON a.id = b.id",
+    "DROP TABLE IF EXISTS t1",
+    "TRUNCATE TABLE t1",
+    "RENAME TABLE t1 TO t2",
+)
+
+
+def warm_up_dfa(statements=None) -> DfaSize:
+    """
+    用一组代表性语句（默认 WARM_UP_CORPUS）预先构建词法/语法 DFA，使正式处理的前若干条语句不必承担冷启动开销。
+    跳过所有缓存和词法快速路径，每条语句都完整经过语法分析；返回预热后的 DFA 规模。
+    """
+    load_grammar()
+    # 预热不是实际处理的语句，不计入 LL 回退统计
+    ll_fallbacks = _parse_stats.ll_fallbacks
+    for sql in statements if statements is not None else WARM_UP_CORPUS:
+        _parse_root(_parsing_context().tokenize(sql))
+    _parse_stats.ll_fallbacks = ll_fallbacks
+    return dfa_size()
+
+
+class DfaLimits:
+    """
+    DFA 和 PredictionContextCache 会随处理的语句不断增长，长时间运行时可能占用数 GB 内存。
+    超过 max_states 个语法 DFA 状态，或距上次清空已完整解析 max_statements 条语句时清空。
+    状态数每完整解析 check_interval 条语句检查一次。
+    """
+
+    def __init__(self, max_states: int = None, max_statements: int = None, check_interval: int = 100):
+        self.max_states = max_states
+        self.max_statements = max_statements
+        self.check_interval = max(1, check_interval)
+        self.statements_since_reset = 0
+
+    def __repr__(self):
+        return (f"DfaLimits(max_states={self.max_states}, max_statements={self.max_statements}, "
+                f"check_interval={self.check_interval})")
+
+
+# 为 None 时 DFA 不设上限
+_dfa_limits: DfaLimits | None = None
+
+
+def set_dfa_limits(max_states: int = None, max_statements: int = None, check_interval: int = 100) -> DfaLimits | None:
+    """
+    设置 DFA 清空策略，两个阈值都为空时取消限制。
+    """
+    global _dfa_limits
+    if max_states is None and max_statements is None:
+        _dfa_limits = None
+    else:
+        _dfa_limits = DfaLimits(max_states, max_statements, check_interval)
+    return _dfa_limits
+
+
+def get_dfa_limits() -> DfaLimits | None:
+    return _dfa_limits
+
+
+def reset_dfa():
+    """
+    清空词法/语法 DFA 和共享的 PredictionContextCache。
+    列表和缓存对象原地修改，已创建的词法/语法分析器也会使用清空后的 DFA；不能在解析过程中调用。
+    """
+    load_grammar()
+    for dfas in (MySqlParser.decisionsToDFA, MySqlLexer.decisionsToDFA):
+        for i, dfa in enumerate(dfas):
+            dfas[i] = DFA(dfa.atnStartState, dfa.decision)
+    MySqlParser.sharedContextCache.cache.clear()
+    _parse_stats.dfa_resets += 1
+    if _dfa_limits is not None:
+        _dfa_limits.statements_since_reset = 0
+
+
+def _check_dfa_limits(limits: DfaLimits, statements: int = 1):
+    """
+    记入刚完整解析的 statements 条语句（整文件模式一次解析多条），超过阈值时清空 DFA。
+    """
+    before = limits.statements_since_reset
+    limits.statements_since_reset += statements
+    count = limits.statements_since_reset
+    if limits.max_statements is not None and count >= limits.max_statements:
+        reset_dfa()
+    elif (limits.max_states is not None and count // limits.check_interval != before // limits.check_interval
+          and dfa_size().parser_states > limits.max_states):
+        reset_dfa()
+
+
+# 词法快速路径：各类语句关键字后可跳过的修饰符，以及表名后允许紧跟的 token
+_INSERT_MODIFIERS: set[int] = set()
+_UPDATE_MODIFIERS: set[int] = set()
+_DELETE_MODIFIERS: set[int] = set()
+_ALTER_MODIFIERS: set[int] = set()
+
+_INSERT_FOLLOW: set[int] = set()
+_UPDATE_FOLLOW: set[int] = set()
+_DELETE_FOLLOW: set[int] = set()
+
+# 表名之后只要出现这些 token，就可能还有其他表引用（子查询、外键、多表语法等）
+# 或者存在未闭合的引号，交给完整解析
+_TAIL_STOP_TOKENS: set[int] = set()
+
+
+def _init_token_sets():
+    # 无法识别的字符（? [ \ { 等）不会跨越缓冲区，不能算作未闭合，否则其后的分号都不可信，整个文件剩余部分会被反复分词
+    _UNTERMINATED_TOKENS.update((
+        MySqlLexer.SINGLE_QUOTE_SYMB, MySqlLexer.DOUBLE_QUOTE_SYMB, MySqlLexer.REVERSE_QUOTE_SYMB,
+    ))
+
+    _INSERT_MODIFIERS.update((MySqlLexer.LOW_PRIORITY, MySqlLexer.DELAYED, MySqlLexer.HIGH_PRIORITY, MySqlLexer.IGNORE))
+    _UPDATE_MODIFIERS.update((MySqlLexer.LOW_PRIORITY, MySqlLexer.IGNORE))
+    _DELETE_MODIFIERS.update((MySqlLexer.LOW_PRIORITY, MySqlLexer.QUICK, MySqlLexer.IGNORE))
+    _ALTER_MODIFIERS.update((MySqlLexer.ONLINE, MySqlLexer.OFFLINE, MySqlLexer.IGNORE))
+
+    _INSERT_FOLLOW.update((MySqlLexer.LR_BRACKET, MySqlLexer.VALUES, MySqlLexer.VALUE, MySqlLexer.SET))
+    _UPDATE_FOLLOW.add(MySqlLexer.SET)
+    _DELETE_FOLLOW.update((MySqlLexer.WHERE, MySqlLexer.ORDER, MySqlLexer.LIMIT, MySqlLexer.SEMI, Token.EOF))
+
+    _TAIL_STOP_TOKENS.update((
+        MySqlLexer.SELECT, MySqlLexer.TABLE, MySqlLexer.FROM, MySqlLexer.JOIN, MySqlLexer.REFERENCES,
+        MySqlLexer.RENAME, MySqlLexer.WITH, MySqlLexer.INTO, MySqlLexer.USING, MySqlLexer.LIKE, MySqlLexer.UNION,
+        MySqlLexer.SINGLE_QUOTE_SYMB, MySqlLexer.DOUBLE_QUOTE_SYMB, MySqlLexer.REVERSE_QUOTE_SYMB,
+    ))
+
+
+def _match_simple_statement(tokens) -> tuple[tuple[int, int, str], ...] | None:
+    """
+    仅凭词法 token 识别 INSERT INTO t / UPDATE t SET / DELETE FROM t / ALTER TABLE t 这几类简单语句，
+    返回与完整解析相同格式的替换元组（表名已带 schema 时为空元组）；无法确定时返回 None，由完整解析器处理。
+    """
+    significant = []
+    for token in tokens:
+        if token.type == MySqlLexer.ERROR_RECONGNIGION:
+            return None
+        if token.channel == Token.DEFAULT_CHANNEL:
+            significant.append(token)
+
+    first = significant[0].type
+    i = 1
+    if first == MySqlLexer.INSERT:
+        i = _skip_tokens(significant, i, _INSERT_MODIFIERS)
+        if significant[i].type == MySqlLexer.INTO:
+            i += 1
+        follow = _INSERT_FOLLOW
+    elif first == MySqlLexer.UPDATE:
+        i = _skip_tokens(significant, i, _UPDATE_MODIFIERS)
+        follow = _UPDATE_FOLLOW
+    elif first == MySqlLexer.DELETE:
+        i = _skip_tokens(significant, i, _DELETE_MODIFIERS)
+        if significant[i].type != MySqlLexer.FROM:
+            return None
+        i += 1
+        follow = _DELETE_FOLLOW
+    elif first == MySqlLexer.ALTER:
+        i = _skip_tokens(significant, i, _ALTER_MODIFIERS)
+        if significant[i].type != MySqlLexer.TABLE:
+            return None
+        i += 1
+        follow = None
+    else:
+        return None
+
+    name = significant[i]
+    if not _is_simple_table_name(name):
+        return None
+    # 已带 schema 的表名（db.t、`db`.`t` 等）无需改写，但仍要确认后面没有其他表引用
+    qualified = False
+    if significant[i + 1].type == MySqlLexer.DOT_ID:
+        qualified = True
+        i += 1
+    elif significant[i + 1].type == MySqlLexer.DOT and _is_simple_table_name(significant[i + 2]):
+        qualified = True
+        i += 2
+    # tail 的最后一个 token 一定是 EOF
+    tail = significant[i + 1:]
+    if len(tail) < 2 and follow is None:
+        return None
+    next_type = tail[0].type
+    if next_type in (MySqlLexer.DOT_ID, MySqlLexer.DOT):
+        return None
+    if follow is not None and next_type not in follow:
+        return None
+    for pos, token in enumerate(tail):
+        if token.type in _TAIL_STOP_TOKENS:
+            return None
+        # 分号只允许出现在末尾
+        if token.type == MySqlLexer.SEMI and pos != len(tail) - 2:
+            return None
+
+    if qualified:
+        return ()
+    return ((name.start, name.stop, name.text),)
+
+
+# 批量 INSERT 快速路径：mysqldump 导出的 INSERT INTO t VALUES (...),(...) 语句往往长达数 MB，
+# 表名只出现在开头几个 token 中。只对 VALUES 之前的部分做词法分析，VALUES 之后用正则确认只含字面量后原样保留
+_BULK_INSERT_MIN_LENGTH = 4096
+
+_BULK_INSERT_NAME_PART = r"(?:[^'\"`();#/-]|`(?:[^`]|``)*+`)"
+_BULK_INSERT_HEAD = re.compile(
+    rf"INSERT\b{_BULK_INSERT_NAME_PART}*?(?:\({_BULK_INSERT_NAME_PART}*\)\s*)?\bVALUES?\s*(?=\()",
+    re.IGNORECASE,
+)
+
+# 只允许字符串、数字、NULL/TRUE/FALSE/DEFAULT 和括号逗号；出现函数、子查询、注释、ON DUPLICATE KEY UPDATE 等都交给完整解析
+_BULK_VALUES_BODY = re.compile(r"""
+    (?:
+        \s++
+      | [(),]
+      | [-+]?+(?:0[xX][0-9a-fA-F]++|0[bB][01]++|(?:[0-9]++(?:\.[0-9]*+)?+|\.[0-9]++)(?:[eE][-+]?+[0-9]++)?+)\b
+      | (?:_[0-9A-Za-z]++\s*+|[xXbBnN])?+'(?:[^'\\]++|\\.|'')*+'
+      | "(?:[^"\\]++|\\.|"")*+"
+      | (?i:NULL|TRUE|FALSE|DEFAULT)\b
+    )*+
+""", re.VERBOSE | re.DOTALL)
+_BULK_VALUES_TAIL = re.compile(_BULK_VALUES_BODY.pattern + r";?\s*", re.VERBOSE | re.DOTALL)
+_WHITESPACE = re.compile(r"\s*")
+
+
+def _match_bulk_insert(sql: str) -> tuple[tuple[int, int, str], ...] | None:
+    """
+    识别 INSERT [INTO] t [(列...)] VALUES 后面只有字面量的长语句，只对 VALUES 之前的部分做词法快速路径匹配，
+    返回与完整解析相同格式的替换元组；不符合时返回 None。
+    """
+    if len(sql) < _BULK_INSERT_MIN_LENGTH:
+        return None
+    head = _BULK_INSERT_HEAD.match(sql, _WHITESPACE.match(sql).end())
+    if head is None:
+        return None
+    load_grammar()
+    timings = _phase_timings
+    if timings is not None:
+        started = time.perf_counter()
+    replacements = None
+    if _BULK_VALUES_TAIL.fullmatch(sql, head.end()):
+        replacements = _match_simple_statement(_parsing_context().tokenize(sql[:head.end()]).tokens)
+    if timings is not None:
+        timings.lap("fast_path", started)
+    if replacements is not None:
+        _parse_stats.statements += 1
+        _parse_stats.fast_path += 1
+        _parse_stats.bulk_inserts += 1
+    return replacements
+
 
-    parser = MySqlParser(token_stream)
-    tree = parser.root()
+def _skip_tokens(tokens, i: int, types: set[int]) -> int:
+    while tokens[i].type in types:
+        i += 1
+    return i
 
-    listener = SchemaModifierListener()
-    walker = ParseTreeWalker()
-    walker.walk(listener, tree)
 
-    return tuple(listener.replacements)
\ No newline at end of file
+def _is_simple_table_name(token) -> bool:
+    if token.type == MySqlLexer.ID:
+        return True
+    # 反引号标识符在该语法中被识别为 STRING_LITERAL
+    return token.type == MySqlLexer.STRING_LITERAL and token.text.startswith("`")
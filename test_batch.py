@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from batch import process_files, resolve_inputs, summarize
+
+
+# noinspection SqlNoDataSourceInspection
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        os.makedirs(os.path.join(self.tmp.name, "v2", "hotfix"))
+        self.paths = []
+        for name, count in (("a.sql", 1), ("v2/b.sql", 30), ("v2/hotfix/c.sql", 5)):
+            path = os.path.join(self.tmp.name, name)
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(f"DELETE FROM t{i};\n" for i in range(count))
+            self.paths.append(path)
+
+    def test_resolve_directory(self):
+        with open(os.path.join(self.tmp.name, "v2", "b_generated.sql"), "w", encoding="utf-8"):
+            pass
+        self.assertEqual(sorted(resolve_inputs([self.tmp.name])), sorted(self.paths))
+
+    def test_resolve_skips_per_schema_outputs_only_next_to_source(self):
+        paths = {}
+        for name in ("a_test.sql", "user_test.sql"):
+            paths[name] = os.path.join(self.tmp.name, name)
+            with open(paths[name], "w", encoding="utf-8"):
+                pass
+        skipped = []
+        inputs = resolve_inputs([self.tmp.name], ["test"], skipped)
+        self.assertIn(paths["user_test.sql"], inputs)
+        self.assertNotIn(paths["a_test.sql"], inputs)
+        self.assertEqual(skipped, [(paths["a_test.sql"], self.paths[0])])
+        # 直接指定的文件不跳过
+        self.assertEqual(resolve_inputs([paths["a_test.sql"]], ["test"]), [paths["a_test.sql"]])
+
+    def test_process_files_in_parallel(self):
+        missing = os.path.join(self.tmp.name, "missing.sql")
+        results = list(process_files(self.paths + [missing], ["s1", "s2"], processes=2))
+        self.assertEqual(sorted(result.input_path for result in results), sorted(self.paths + [missing]))
+
+        by_path = {result.input_path: result for result in results}
+        self.assertIsNotNone(by_path[missing].failure)
+        result = by_path[self.paths[1]]
+        self.assertIsNone(result.failure)
+        self.assertEqual(result.statements, 30)
+        self.assertEqual(result.bytes, os.path.getsize(self.paths[1]))
+        with open(result.outputs[0], "r", encoding="utf-8") as f:
+            self.assertIn("DELETE FROM s2.t29;", f.read())
+
+        summary = summarize(results, 1.0)
+        self.assertEqual((summary.files, summary.failed, summary.statements), (4, 1, 36))
+        self.assertIn("共处理 4 个文件（失败 1 个），36 条语句", str(summary))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_corpus_is_deterministic(self):
+        for category in benchmark.CATEGORIES:
+            self.assertEqual(benchmark.build_corpus(category, 0.01), benchmark.build_corpus(category, 0.01))
+
+    def test_run_small_dml(self):
+        report = benchmark.run_benchmark(["small_dml"], scale=0.01, repeat=1, warmup=False)
+        result = report["categories"]["small_dml"]
+        self.assertEqual(result["statements"], 20)
+        self.assertEqual(set(result["phases"]), set(benchmark.PHASES))
+        self.assertGreater(result["statements_per_sec"], 0)
+        # INSERT/UPDATE/DELETE 走快速路径，SELECT 经过完整解析
+        self.assertEqual(result["fast_path"], 15)
+        self.assertGreater(result["phases"]["parse"], 0)
+        self.assertGreater(result["phases"]["extract"], 0)
+        self.assertIn("small_dml", benchmark.format_report(report, baseline=report))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from dfa_cache import load_dfa, save_dfa
+from sql_utils import add_schema_to_sql, dfa_size, get_parse_stats, warm_up_dfa
+
+
+class TestDfaCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "dfa.pickle")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_warm_up_grows_dfa(self):
+        stats = get_parse_stats()
+        ll_fallbacks = stats.ll_fallbacks
+        size = warm_up_dfa(["SELECT name FROM t_warm WHERE id BETWEEN 1 AND 9"])
+        self.assertEqual(size, dfa_size())
+        self.assertGreater(size.parser_states, 0)
+        self.assertGreater(size.lexer_states, 0)
+        self.assertEqual(stats.ll_fallbacks, ll_fallbacks)
+
+    def test_save_and_load(self):
+        warm_up_dfa(["UPDATE t_warm SET a = 1 WHERE id = 2"])
+        self.assertTrue(save_dfa(self.path))
+        size = dfa_size()
+        self.assertTrue(load_dfa(self.path))
+        self.assertEqual(dfa_size(), size)
+        self.assertEqual(add_schema_to_sql("SELECT * FROM t_after_load", "s"), "SELECT * FROM s.t_after_load")
+
+    def test_save_to_unwritable_path(self):
+        with open(self.path, "wb"):
+            pass
+        # 父路径是普通文件，无法创建目录
+        self.assertFalse(save_dfa(os.path.join(self.path, "dfa.pickle")))
+
+    def test_load_invalid_snapshot(self):
+        self.assertFalse(load_dfa(self.path))
+        with open(self.path, "wb") as f:
+            f.write(b"not a pickle")
+        size = dfa_size()
+        self.assertFalse(load_dfa(self.path))
+        self.assertEqual(dfa_size(), size)
+
+
+if __name__ == "__main__":
+    unittest.main()
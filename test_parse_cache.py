@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+from parse_cache import ParseCache
+from sql_utils import (
+    add_schema_to_sql,
+    caches_disabled,
+    enable_parse_cache,
+    disable_parse_cache,
+    get_parse_stats,
+    reset_parse_stats,
+    _get_table_replacements,
+)
+
+
+# noinspection SqlNoDataSourceInspection
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "cache.sqlite3")
+
+    def test_hit_skips_parsing_across_runs(self):
+        sql = "SELECT * FROM t_cache_a JOIN t_cache_b ON t_cache_a.id = t_cache_b.id"
+        expected = "SELECT * FROM s.t_cache_a JOIN s.t_cache_b ON t_cache_a.id = t_cache_b.id"
+        self.addCleanup(disable_parse_cache)
+
+        enable_parse_cache(self.path)
+        _get_table_replacements.cache_clear()
+        self.assertEqual(add_schema_to_sql(sql, "s"), expected)
+        disable_parse_cache()
+
+        # 模拟新进程：清空进程内 LRU 缓存后重新打开持久化缓存
+        _get_table_replacements.cache_clear()
+        reset_parse_stats()
+        cache = enable_parse_cache(self.path)
+        self.assertEqual(add_schema_to_sql(sql, "s"), expected)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(get_parse_stats().statements, 0)
+
+    def test_caches_disabled(self):
+        sql = "SELECT * FROM t_cache_off_a JOIN t_cache_off_b ON 1"
+        self.addCleanup(disable_parse_cache)
+        cache = enable_parse_cache(self.path)
+        add_schema_to_sql(sql, "s")
+        size = len(cache)
+
+        # LRU 和持久化缓存中都已有该语句，绕过缓存时仍重新分析，且不写入缓存
+        reset_parse_stats()
+        with caches_disabled():
+            for _ in range(2):
+                add_schema_to_sql(sql, "s")
+            add_schema_to_sql("SELECT * FROM t_cache_off_c", "s")
+        self.assertEqual(get_parse_stats().statements, 3)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(len(cache), size)
+
+        add_schema_to_sql(sql, "s")
+        self.assertEqual(get_parse_stats().statements, 3)
+
+    def test_lru_eviction(self):
+        cache = ParseCache(self.path, max_entries=10)
+        self.addCleanup(cache.close)
+        for i in range(10):
+            cache.put(f"stmt {i}", ((0, 0, f"t{i}"),))
+        # 访问 stmt 0 使其成为最近使用
+        self.assertEqual(cache.get("stmt 0"), ((0, 0, "t0"),))
+        cache.put("stmt 10", ())
+
+        self.assertEqual(len(cache), 9)
+        self.assertEqual(cache.evictions, 2)
+        self.assertIsNotNone(cache.get("stmt 0"))
+        self.assertIsNone(cache.get("stmt 1"))
+        self.assertIsNone(cache.get("stmt 2"))
+        self.assertEqual(cache.get("stmt 10"), ())
+
+    def test_writes_do_not_hold_transaction(self):
+        # 多个进程共用缓存文件时，get / put 之间不能一直持有写事务，否则其他进程会被阻塞
+        first = ParseCache(self.path)
+        second = ParseCache(self.path)
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+        first.put("stmt a", ((0, 0, "a"),))
+        first.flush()
+        self.assertEqual(first.get("stmt a"), ((0, 0, "a"),))
+        first.put("stmt b", ())
+        self.assertFalse(first._conn.in_transaction)
+
+        second.put("stmt c", ())
+        second.flush()
+        self.assertEqual(second.errors, 0)
+        self.assertEqual(second.get("stmt a"), ((0, 0, "a"),))
+        first.flush()
+        self.assertEqual(first.get("stmt c"), ())
+
+
+if __name__ == "__main__":
+    unittest.main()
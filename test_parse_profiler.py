@@ -0,0 +1,31 @@
+import io
+import unittest
+
+from parse_profiler import format_profile_report, profile_statements, slowest
+from sql_utils import iter_sql_statements_with_positions
+
+
+class TestParseProfiler(unittest.TestCase):
+    def test_statement_positions(self):
+        sql = "-- header\nINSERT INTO a VALUES (1);\n\n/* 'x;' */\nUPDATE b\nSET c = 1; DELETE FROM d;\n"
+        expected = [(2, 0, "INSERT INTO a VALUES (1)"), (5, 0, "UPDATE b\nSET c = 1"), (6, 11, "DELETE FROM d")]
+        self.assertEqual(list(iter_sql_statements_with_positions(sql)), expected)
+        # 跨越读取块边界时位置仍然正确
+        self.assertEqual(list(iter_sql_statements_with_positions(io.StringIO(sql), chunk_size=7)), expected)
+
+    def test_profile_report(self):
+        sql = ("INSERT INTO a VALUES (1);\n"
+               "CREATE PROCEDURE p(IN p_id INT, OUT p_total INT)\n"
+               "SELECT SUM(amount) INTO p_total FROM t WHERE id = p_id;\n")
+        profiles = profile_statements(sql)
+        self.assertEqual([p.line for p in profiles], [1, 2])
+        self.assertTrue(profiles[0].fast_path)
+        self.assertFalse(profiles[0].ll_fallback)
+        self.assertTrue(profiles[1].ll_fallback)
+        self.assertGreater(profiles[1].full_context, 0)
+        self.assertEqual(slowest(profiles, 1), [max(profiles, key=lambda p: p.seconds)])
+        self.assertIn("CREATE PROCEDURE p", format_profile_report(profiles, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
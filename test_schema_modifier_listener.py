@@ -0,0 +1,64 @@
+import unittest
+
+from antlr4 import CommonTokenStream, InputStream, ParseTreeWalker
+
+from MySqlLexer import MySqlLexer
+from MySqlParser import MySqlParser
+from schema_modifier_listener import SchemaModifierListener, TableNameCollectingParser
+
+
+def _token_stream(sql: str) -> CommonTokenStream:
+    lexer = MySqlLexer(InputStream(sql))
+    lexer.removeErrorListeners()
+    return CommonTokenStream(lexer)
+
+
+def _parse_both(sql: str, rule: str = "root", skip: int = 0):
+    """
+    分别用构建语法树 + ParseTreeWalker 遍历 SchemaModifierListener，以及 TableNameCollectingParser
+    解析 sql（从第 skip 个 token 开始调用 rule），返回两者的结果和 TableNameCollectingParser 记录的上下文。
+    """
+    parser = MySqlParser(_token_stream(sql))
+    parser.removeErrorListeners()
+    for _ in range(skip):
+        parser._input.consume()
+    listener = SchemaModifierListener()
+    ParseTreeWalker.DEFAULT.walk(listener, getattr(parser, rule)())
+
+    collecting = TableNameCollectingParser(_token_stream(sql))
+    collecting.removeErrorListeners()
+    for _ in range(skip):
+        collecting._input.consume()
+    getattr(collecting, rule)()
+    return listener.replacements, collecting.table_replacements(), collecting.table_name_contexts
+
+
+# noinspection SqlNoDataSourceInspection
+class TestTableNameCollectingParser(unittest.TestCase):
+    def test_matches_listener(self):
+        for sql in (
+            "SELECT a.id FROM t1 a JOIN db.t2 b ON a.id = b.id WHERE a.x IN (SELECT id FROM `t3`)",
+            "INSERT INTO t1 (a, b) SELECT a, b FROM db.`t2` WHERE c = 1",
+            "UPDATE t1 JOIN t2 ON t1.id = t2.id SET t1.a = 1",
+            "CREATE TABLE t1 (id INT, FOREIGN KEY (id) REFERENCES db.t2 (id)); DROP TABLE IF EXISTS t1, `db`.`t3`",
+            "RENAME TABLE t1 TO t2, db.t3 TO t4",
+            # 语法错误，经错误恢复后继续
+            "SELECT * FROM t1 JOIN ON x; DELETE FROM t2 WHERE",
+        ):
+            with self.subTest(sql=sql):
+                expected, actual, _ = _parse_both(sql)
+                self.assertEqual(actual, expected)
+
+        expected, actual, _ = _parse_both("SELECT * FROM db.t1 JOIN `t2` ON 1")
+        self.assertEqual(actual, [(25, 28, "`t2`")])
+
+    def test_recovery_with_stop_before_start(self):
+        # 表名位置已到达输入末尾，错误恢复后上下文的 stop 是 start 之前的 FROM
+        expected, actual, contexts = _parse_both("FROM", rule="tableName", skip=1)
+        self.assertLess(contexts[0].stop.tokenIndex, contexts[0].start.tokenIndex)
+        self.assertEqual(actual, expected)
+        self.assertEqual(actual, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
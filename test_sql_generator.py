@@ -0,0 +1,208 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import add_schema
+from sql_generator import (
+    GenerationCancelled,
+    generate_schema_files,
+    generate_sql_file,
+    iter_file_rewrite_plans,
+    iter_rewrite_plans,
+    output_path_for,
+    write_generated_sql,
+)
+from sql_utils import SqlSyntaxError
+
+
+# noinspection SqlNoDataSourceInspection
+class TestSQLGenerator(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.input_path = os.path.join(self.tmp.name, "release.sql")
+        with open(self.input_path, "w", encoding="utf-8") as f:
+            f.write("-- 建表\nCREATE TABLE t1 (id INT);\nINSERT INTO t1 (id) VALUES (1);\n")
+
+    @staticmethod
+    def read(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def test_generate_sql_file(self):
+        output_path = generate_sql_file(self.input_path, ["s1", "s2"])
+        self.assertEqual(output_path, os.path.join(self.tmp.name, "release_generated.sql"))
+        self.assertEqual(
+            self.read(output_path),
+            "CREATE TABLE s1.t1 (id INT);\n\nINSERT INTO s1.t1 (id) VALUES (1);\n\n"
+            "CREATE TABLE s2.t1 (id INT);\n\nINSERT INTO s2.t1 (id) VALUES (1);\n\n",
+        )
+
+    def test_utf8_bom(self):
+        with open(self.input_path, "w", encoding="utf-8-sig") as f:
+            f.write("DELETE FROM t1;\n-- 注释\nUPDATE t2 SET id = 1;\n")
+        errors = []
+        output_path = generate_sql_file(self.input_path, ["s1"], on_error="abort", errors=errors)
+        self.assertEqual(self.read(output_path), "DELETE FROM s1.t1;\n\nUPDATE s1.t2 SET id = 1;\n\n")
+
+        output_path = generate_sql_file(self.input_path, ["s1", "s2"], whole_file=True)
+        with open(output_path, "rb") as f:
+            output = f.read().decode("utf-8")
+        self.assertEqual(output.count("\ufeff"), 0)
+        self.assertEqual(output.count("UPDATE s2.t2 SET"), 1)
+        self.assertTrue(output.startswith("DELETE FROM s1.t1;\n-- 注释\n"))
+
+    def test_on_error_policies(self):
+        with open(self.input_path, "a", encoding="utf-8") as f:
+            f.write("  SELECT * FRM t2;\nDELETE FROM t3;\n")
+
+        errors = []
+        plans = list(iter_file_rewrite_plans(self.input_path, on_error="skip", errors=errors))
+        self.assertEqual([plan.apply("s") for plan in plans],
+                         ["CREATE TABLE s.t1 (id INT)", "INSERT INTO s.t1 (id) VALUES (1)", "DELETE FROM s.t3"])
+        self.assertEqual(len(errors), 1)
+        error = errors[0]
+        self.assertEqual((error.statement_index, error.line, error.column, error.offending_token), (2, 4, 11, "FRM"))
+
+        plans = list(iter_file_rewrite_plans(self.input_path, on_error="passthrough"))
+        self.assertEqual(plans[2].apply("s"), "SELECT * FRM t2")
+
+        with self.assertRaises(SqlSyntaxError):
+            generate_sql_file(self.input_path, ["s1"], on_error="abort")
+        self.assertFalse(os.path.exists(output_path_for(self.input_path)))
+
+        # 已有的输出文件在处理失败时保持不变，也不会留下临时文件
+        with open(output_path_for(self.input_path), "w", encoding="utf-8") as f:
+            f.write("old")
+        with self.assertRaises(SqlSyntaxError):
+            generate_sql_file(self.input_path, ["s1", "s2"], on_error="abort")
+        self.assertEqual(self.read(output_path_for(self.input_path)), "old")
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["release.sql", "release_generated.sql"])
+
+    def test_whole_file_mode(self):
+        output_path = generate_sql_file(self.input_path, ["s1", "s2"], whole_file=True)
+        self.assertEqual(
+            self.read(output_path),
+            "-- 建表\nCREATE TABLE s1.t1 (id INT);\nINSERT INTO s1.t1 (id) VALUES (1);\n\n"
+            "-- 建表\nCREATE TABLE s2.t1 (id INT);\nINSERT INTO s2.t1 (id) VALUES (1);\n\n",
+        )
+
+        # 原有换行符和非 ASCII 字符按字节原样写出，末尾补上分号
+        with open(self.input_path, "wb") as f:
+            f.write("-- 订单\r\nUPDATE t1 SET name = '张三' WHERE id = 1;\r\nDELETE FROM `表2`\r\n".encode("utf-8"))
+        generate_sql_file(self.input_path, ["s1"], whole_file=True)
+        with open(output_path, "rb") as f:
+            self.assertEqual(f.read().decode("utf-8"),
+                             "-- 订单\r\nUPDATE s1.t1 SET name = '张三' WHERE id = 1;\r\nDELETE FROM s1.`表2`\n;\n\n")
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["release.sql", "release_generated.sql"])
+
+    def test_per_schema_files(self):
+        with open(self.input_path, "a", encoding="utf-8") as f:
+            f.writelines(f"DELETE FROM t{i};\n" for i in range(450))
+        output_paths = generate_schema_files(self.input_path, ["s1", "s2"], workers=2)
+        self.assertEqual(output_paths, [os.path.join(self.tmp.name, "release_s1.sql"),
+                                        os.path.join(self.tmp.name, "release_s2.sql")])
+        for schema, output_path in zip(["s1", "s2"], output_paths):
+            self.assertEqual(
+                self.read(output_path),
+                f"CREATE TABLE {schema}.t1 (id INT);\n\nINSERT INTO {schema}.t1 (id) VALUES (1);\n\n"
+                + "".join(f"DELETE FROM {schema}.t{i};\n\n" for i in range(450)),
+            )
+
+        output_paths = generate_schema_files(self.input_path, ["s1", "s2"], whole_file=True)
+        self.assertTrue(self.read(output_paths[1]).startswith("-- 建表\nCREATE TABLE s2.t1 (id INT);\n"))
+
+        with self.assertRaises(ValueError):
+            generate_schema_files(self.input_path, ["../s1"])
+
+    def test_per_schema_files_replaced_together(self):
+        s1_path = os.path.join(self.tmp.name, "release_s1.sql")
+        with open(s1_path, "w", encoding="utf-8") as f:
+            f.write("old")
+        real_replace = os.replace
+
+        def replace(src, dst):
+            if dst.endswith("release_s2.sql"):
+                raise PermissionError(dst)
+            real_replace(src, dst)
+
+        # 中间的文件替换失败时，已替换的文件恢复原来的内容或被删除，也不留下临时文件和备份文件
+        for whole_file in (False, True):
+            with mock.patch("os.replace", replace), self.assertRaises(PermissionError):
+                generate_schema_files(self.input_path, ["s1", "s2", "s3"], whole_file=whole_file)
+            self.assertEqual(self.read(s1_path), "old")
+            self.assertEqual(sorted(os.listdir(self.tmp.name)), ["release.sql", "release_s1.sql"])
+
+    def test_progress_and_cancel(self):
+        seen = []
+        plans = list(iter_file_rewrite_plans(self.input_path, progress=lambda done, total: seen.append((done, total))))
+        self.assertEqual(len(plans), 2)
+        self.assertEqual(seen, [(1, None), (2, None)])
+
+        # 与图形界面相同：边读边写，读到第一条语句后取消
+        with open(self.input_path, "a", encoding="utf-8") as f:
+            f.writelines(f"DELETE FROM t{i};\n" for i in range(1500))
+        cancel_event = threading.Event()
+        seen = []
+
+        def progress(bytes_read, file_size):
+            seen.append(bytes_read)
+            cancel_event.set()
+
+        plans = iter_file_rewrite_plans(self.input_path, cancel_event=cancel_event, byte_progress=progress)
+        with self.assertRaises(GenerationCancelled):
+            write_generated_sql(output_path_for(self.input_path), plans, ["s1", "s2"], cancel_event)
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(os.listdir(self.tmp.name), ["release.sql"])
+
+    def test_byte_progress(self):
+        seen = []
+        plans = list(iter_file_rewrite_plans(self.input_path, byte_progress=lambda done, total: seen.append((done, total))))
+        self.assertEqual(len(plans), 2)
+        size = os.path.getsize(self.input_path)
+        self.assertEqual(seen[-1], (size, size))
+
+    def test_parallel_plans_keep_order(self):
+        statements = [f"INSERT INTO t{i} (id) VALUES ({i})" for i in range(450)]
+        statements.append("SELECT * FROM a JOIN b ON a.id = b.id")
+        serial = list(iter_rewrite_plans(statements, workers=1))
+        parallel = list(iter_rewrite_plans(statements, workers=2))
+        self.assertEqual(parallel, serial)
+        self.assertEqual(parallel[-1].apply("s1"), "SELECT * FROM s1.a JOIN s1.b ON a.id = b.id")
+
+    def test_cli_with_glob_and_schemas_file(self):
+        conf_path = os.path.join(self.tmp.name, "schemas.conf")
+        with open(conf_path, "w", encoding="utf-8") as f:
+            f.write("s1\n\ns2\n")
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            code = add_schema.main(["-c", conf_path, os.path.join(self.tmp.name, "*.sql")])
+
+        self.assertEqual(code, 0)
+        self.assertIn(output_path_for(self.input_path), stdout.getvalue())
+        self.assertIn("INSERT INTO s2.t1", self.read(output_path_for(self.input_path)))
+
+        # 再次按 glob 处理时跳过上次生成的各 schema 文件
+        for _ in range(2):
+            with contextlib.redirect_stdout(io.StringIO()) as stdout, \
+                    contextlib.redirect_stderr(io.StringIO()) as stderr:
+                code = add_schema.main(["-c", conf_path, "--per-schema", os.path.join(self.tmp.name, "*.sql")])
+            self.assertEqual(code, 0)
+        self.assertEqual(stdout.getvalue().count("->"), 1)
+        self.assertIn("release_s1.sql: 已跳过", stderr.getvalue())
+
+    def test_cli_reports_missing_file(self):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            code = add_schema.main(["-s", "s1", os.path.join(self.tmp.name, "missing.sql")])
+        self.assertEqual(code, 1)
+        self.assertIn("missing.sql", stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,32 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import threading
 import unittest
 
-from sql_utils import split_sql_statements, add_schema_to_sql
+from sql_utils import (
+    split_sql_statements,
+    iter_sql_statements,
+    add_schema_to_sql,
+    build_rewrite_plan,
+    splice,
+    get_parse_stats,
+    reset_parse_stats,
+    collect_phase_timings,
+    PhaseTimings,
+    get_phase_timings,
+    dfa_size,
+    set_dfa_limits,
+    SqlSyntaxError,
+    build_script_rewrite_plan,
+    script_ends_with_terminator,
+    load_grammar,
+    _analyze_statement,
+    _match_simple_statement,
+    _parsing_context,
+)
 
 
 # noinspection SqlNoDataSourceInspection
@@ -85,5 +111,331 @@ class TestSQLLogic(unittest.TestCase):
         result = add_schema_to_sql(stmts[0], self.schema)
         self.assertEqual(result, expected)
 
+    def test_sll_parse_without_fallback(self):
+        reset_parse_stats()
+        sql = "SELECT a.id FROM t_sll_a a JOIN t_sll_b b ON a.id = b.id WHERE a.x IN (SELECT y FROM t_sll_c)"
+        result = add_schema_to_sql(sql, self.schema)
+        self.assertIn(f"FROM {self.schema}.t_sll_a", result)
+        self.assertIn(f"JOIN {self.schema}.t_sll_b", result)
+        self.assertIn(f"FROM {self.schema}.t_sll_c", result)
+        stats = get_parse_stats()
+        self.assertEqual(stats.statements, 1)
+        self.assertEqual(stats.ll_fallbacks, 0)
+
+    def test_lexer_fast_path(self):
+        reset_parse_stats()
+        cases = {
+            "INSERT INTO t_fast (id, name) VALUES (1, 'a;b'), (2, 'FROM')":
+                f"INSERT INTO {self.schema}.t_fast (id, name) VALUES (1, 'a;b'), (2, 'FROM')",
+            "UPDATE `t_fast` SET name = 'x' WHERE id = 1":
+                f"UPDATE {self.schema}.`t_fast` SET name = 'x' WHERE id = 1",
+            "DELETE FROM t_fast WHERE id = 1":
+                f"DELETE FROM {self.schema}.t_fast WHERE id = 1",
+            "ALTER TABLE t_fast ADD COLUMN age INT":
+                f"ALTER TABLE {self.schema}.t_fast ADD COLUMN age INT",
+        }
+        for sql, expected in cases.items():
+            self.assertEqual(add_schema_to_sql(sql, self.schema), expected)
+        self.assertEqual(get_parse_stats().fast_path, len(cases))
+
+    def test_lexer_fast_path_falls_through(self):
+        reset_parse_stats()
+        sql = "INSERT INTO t_slow (id) SELECT id FROM t_src"
+        result = add_schema_to_sql(sql, self.schema)
+        self.assertEqual(result, f"INSERT INTO {self.schema}.t_slow (id) SELECT id FROM {self.schema}.t_src")
+        self.assertEqual(get_parse_stats().fast_path, 0)
+
+    def test_lexer_fast_path_agrees_with_parser(self):
+        tails = {
+            "ALTER TABLE t_tail": (
+                "UNION=(t_p1,t_p2)", "UNION (t_p1)", "ADD COLUMN c INT AFTER b", "ADD INDEX idx (a)",
+                "ADD CONSTRAINT fk FOREIGN KEY (a) REFERENCES t_p (id)", "ADD FOREIGN KEY (a) REFERENCES `t_p`(id)",
+                "ADD CHECK (a > (SELECT 1 FROM t_p))", "RENAME TO t_p", "RENAME AS db.t_p", "RENAME COLUMN a TO b",
+                "EXCHANGE PARTITION p0 WITH TABLE t_p", "ENGINE=InnoDB", "COMMENT = 'FROM t_p'",
+                "MODIFY c VARCHAR(10) DEFAULT 'x'", "CHANGE a b INT", "CONVERT TO CHARACTER SET utf8mb4",
+                "REORGANIZE PARTITION p0 INTO (PARTITION p1 VALUES LESS THAN (5))",
+            ),
+            "UPDATE t_tail": (
+                "SET a = 1", "SET a = (SELECT b FROM t_p)", "SET a = 1 WHERE b IN (SELECT c FROM t_p)",
+                "SET a = 1 WHERE EXISTS (SELECT 1 FROM t_p)", "SET a = 1 ORDER BY b LIMIT 1",
+                "JOIN t_p ON t_tail.id = t_p.id SET a = 1", ", t_p SET a = 1", "AS x SET x.a = 1",
+            ),
+            "DELETE FROM t_tail": (
+                "", "WHERE a = 1", "WHERE a IN (SELECT b FROM t_p)", "WHERE a = (SELECT MAX(b) FROM t_p)",
+                "ORDER BY a LIMIT 1", "USING t_tail JOIN t_p", "AS x WHERE x.a = 1", "PARTITION (p0) WHERE a = 1",
+            ),
+            "INSERT INTO t_tail": (
+                "VALUES (1)", "(a) VALUES (1)", "SET a = 1", "(a) SELECT a FROM t_p", "SELECT * FROM t_p",
+                "VALUES (1) ON DUPLICATE KEY UPDATE a = VALUES(a)", "(a) VALUES ((SELECT b FROM t_p))",
+                "VALUES (1) AS new ON DUPLICATE KEY UPDATE a = new.a", "PARTITION (p0) VALUES (1)",
+            ),
+        }
+        # 已带 schema 的表名
+        for head in list(tails):
+            for qualified in ("db.t_tail", "`db`.`t_tail`", "db.`t_tail`", "`db`.t_tail", "db.t_tail.x"):
+                tails[head.replace("t_tail", qualified)] = tails[head]
+        load_grammar()
+        for head, statement_tails in tails.items():
+            for tail in statement_tails:
+                sql = f"{head} {tail}".strip()
+                with self.subTest(sql=sql):
+                    fast = _match_simple_statement(_parsing_context().tokenize(sql).tokens)
+                    # 严格模式不走快速路径，结果即完整解析的结果
+                    if fast is not None:
+                        self.assertEqual(fast, _analyze_statement(sql, strict=True))
+
+    def test_bulk_insert_fast_path(self):
+        reset_parse_stats()
+        rows = ",".join(f"({i}, 'it''s \\' {i}', NULL, -1.5e3, _binary 'x', 0x1F)" for i in range(200))
+        sql = f"INSERT IGNORE INTO `t_bulk` (`id`, `name`, a, b, c, d) VALUES {rows}"
+        self.assertEqual(add_schema_to_sql(sql, self.schema), sql.replace("`t_bulk`", f"{self.schema}.`t_bulk`"))
+        self.assertEqual(get_parse_stats().bulk_inserts, 1)
+
+        # 已带 schema 的表名同样走快速路径，无需改写
+        for name in ("db.`t_bulk`", "`db`.`t_bulk`", "db.t_bulk"):
+            qualified = f"INSERT INTO {name} VALUES {rows}"
+            self.assertEqual(add_schema_to_sql(qualified, self.schema), qualified)
+        self.assertEqual(get_parse_stats().bulk_inserts, 4)
+
+        # 切分时批量 INSERT 不经过词法分析，字符串中的分号和跨越读取块的字符串仍要正确处理
+        script = f"{sql};\nINSERT INTO t_bulk VALUES (1, 'a;\nb');\nDELETE FROM t_bulk"
+        self.assertEqual(list(iter_sql_statements(script, chunk_size=100)),
+                         [sql, "INSERT INTO t_bulk VALUES (1, 'a;\nb')", "DELETE FROM t_bulk"])
+
+        # VALUES 中出现子查询时必须完整解析
+        sql = f"INSERT INTO t_bulk VALUES {rows}, ((SELECT MAX(id) FROM t_bulk_src), '', NULL, 0, '', 0)"
+        self.assertIn(f"FROM {self.schema}.t_bulk_src", add_schema_to_sql(sql, self.schema))
+        self.assertEqual(get_parse_stats().bulk_inserts, 4)
+
+    def test_rewrite_plan_reused_across_schemas(self):
+        reset_parse_stats()
+        plan = build_rewrite_plan("SELECT * FROM t_plan_a JOIN t_plan_b ON t_plan_a.id = t_plan_b.id")
+        for schema in ("s1", "s2", "s3"):
+            self.assertEqual(
+                plan.apply(schema),
+                f"SELECT * FROM {schema}.t_plan_a JOIN {schema}.t_plan_b ON t_plan_a.id = t_plan_b.id",
+            )
+        self.assertEqual(get_parse_stats().statements, 1)
+
+    def test_splice(self):
+        text = "SELECT * FROM a JOIN b"
+        self.assertEqual(splice(text, [(21, 21, "s.b"), (14, 14, "s.a")]), "SELECT * FROM s.a JOIN s.b")
+        self.assertEqual(splice(text, [(0, -1, "/* x */ ")]), "/* x */ " + text)
+        self.assertEqual(splice(text, []), text)
+        with self.assertRaises(ValueError):
+            splice(text, [(14, 16, "x"), (15, 15, "y")])
+
+    def test_split_keeps_original_text(self):
+        sql = """
+        -- 迁移脚本
+        INSERT INTO t (id, name)
+            VALUES (1, 'a'),   (2, 'b');   -- 行尾注释
+        select  *  from t where /* 内联注释 */ id = 1;
+        """
+        stmts = split_sql_statements(sql)
+        self.assertEqual(stmts, [
+            "INSERT INTO t (id, name)\n            VALUES (1, 'a'),   (2, 'b')",
+            "select  *  from t where /* 内联注释 */ id = 1",
+        ])
+        self.assertEqual(add_schema_to_sql(stmts[1], self.schema),
+                         f"select  *  from {self.schema}.t where /* 内联注释 */ id = 1")
+
+    def test_iter_sql_statements_streaming(self):
+        sql = """/*!40101 SET NAMES utf8 */;
+        -- 创建表
+        CREATE TABLE t (id INT, s VARCHAR(10) DEFAULT ';');
+        INSERT INTO t VALUES (1, 'a;b'), (2, "c;d"); /* 注释; */
+        ;
+        UPDATE t SET s = 'x' WHERE id = 1 # 行尾注释 ;
+        ;
+        DELETE FROM t"""
+        expected = [
+            "/*!40101 SET NAMES utf8 */",
+            "CREATE TABLE t (id INT, s VARCHAR(10) DEFAULT ';')",
+            "INSERT INTO t VALUES (1, 'a;b'), (2, \"c;d\")",
+            "UPDATE t SET s = 'x' WHERE id = 1",
+            "DELETE FROM t",
+        ]
+        self.assertEqual(list(iter_sql_statements(sql)), expected)
+        # 块边界落在字符串、注释内部时结果不变
+        for chunk_size in (1, 3, 7, 16):
+            self.assertEqual(list(iter_sql_statements(io.StringIO(sql), chunk_size=chunk_size)), expected)
+
+    def test_split_does_not_stall_on_unknown_characters(self):
+        # 无法识别的字符不能阻止切分推进，否则文件剩余部分会一直留在缓冲区中反复分词
+        source = io.StringIO("SELECT ? FROM t_q;\n" + "DELETE FROM t_q;\n" * 5000)
+        statements = iter_sql_statements(source, chunk_size=1024)
+        self.assertEqual(next(statements), "SELECT ? FROM t_q")
+        self.assertLess(source.tell(), 4096)
+        self.assertEqual(sum(1 for _ in statements), 5000)
+
+    def test_phase_timings(self):
+        with collect_phase_timings() as timings:
+            statements = split_sql_statements("DELETE FROM t_timing WHERE id = 1; SELECT * FROM t_timing_a, t_timing_b")
+            for statement in statements:
+                add_schema_to_sql(statement, self.schema)
+        self.assertIsNone(get_phase_timings())
+        self.assertEqual(timings.counts["split"], 2)
+        self.assertEqual(timings.counts["lex"], 2)
+        self.assertEqual(timings.counts["fast_path"], 2)
+        self.assertEqual(timings.counts["parse"], 1)
+        self.assertEqual(timings.counts["splice"], 2)
+        self.assertGreater(timings.seconds["parse"], 0)
+        self.assertIn("parse", timings.summary())
+
+        # 按 schema 输出多个文件时多个写线程同时累加 splice
+        timings = PhaseTimings()
+        threads = [threading.Thread(target=lambda: [timings.add("splice", 0.001) for _ in range(5000)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(timings.counts["splice"], 40000)
+
+    def test_dfa_reset_by_statement_count(self):
+        stats = get_parse_stats()
+        resets = stats.dfa_resets
+        set_dfa_limits(max_statements=2)
+        try:
+            for i in range(5):
+                sql = f"SELECT * FROM t_reset_{i} a JOIN t_other_{i} b ON a.id = b.id"
+                self.assertEqual(add_schema_to_sql(sql, self.schema),
+                                 f"SELECT * FROM {self.schema}.t_reset_{i} a JOIN {self.schema}.t_other_{i} b ON a.id = b.id")
+        finally:
+            set_dfa_limits()
+        self.assertEqual(stats.dfa_resets - resets, 2)
+        self.assertGreater(dfa_size().parser_states, 0)
+
+        # 整文件模式一次解析整个脚本，同样按语句数计入
+        script = "".join(f"DELETE FROM t_reset_script WHERE id IN (SELECT id FROM t_src_{i});\n" for i in range(3))
+        resets = stats.dfa_resets
+        set_dfa_limits(max_statements=3)
+        try:
+            build_script_rewrite_plan(script)
+        finally:
+            set_dfa_limits()
+        self.assertEqual(stats.dfa_resets - resets, 1)
+
+    def test_strict_mode_reports_syntax_error(self):
+        sql = "SELECT *\nFROM t_strict WHERE"
+        # 默认的错误恢复会悄悄丢掉表名
+        self.assertEqual(add_schema_to_sql(sql, self.schema), sql)
+        with self.assertRaises(SqlSyntaxError) as cm:
+            build_rewrite_plan(sql, strict=True)
+        error = cm.exception
+        self.assertEqual((error.line, error.column, error.offending_token), (2, 19, "<EOF>"))
+        self.assertEqual(error.sql, sql)
+        self.assertIsNone(error.statement_index)
+        self.assertEqual(build_rewrite_plan("SELECT * FROM t_strict", strict=True).apply(self.schema),
+                         f"SELECT * FROM {self.schema}.t_strict")
+
+    def test_strict_mode_skips_fast_path(self):
+        for sql in ("UPDATE t_strict_fast SET;", "INSERT INTO t_strict_fast VALUES (1,;",
+                    "DELETE FROM t_strict_fast WHERE;"):
+            self.assertEqual(add_schema_to_sql(sql, self.schema).count(f"{self.schema}."), 1)
+            with self.assertRaises(SqlSyntaxError):
+                build_rewrite_plan(sql, strict=True)
+
+        reset_parse_stats()
+        rows = ",".join(f"({i}, 'x')" for i in range(200))
+        sql = f"INSERT INTO t_strict_bulk VALUES {rows}"
+        self.assertEqual(build_rewrite_plan(sql, strict=True).apply(self.schema),
+                         sql.replace("t_strict_bulk", f"{self.schema}.t_strict_bulk"))
+        self.assertEqual(get_parse_stats().fast_path, 0)
+
+    def test_script_rewrite_keeps_formatting(self):
+        script = ("-- 建表\nCREATE TABLE t_script (\n  id INT -- 主键\n);\n\n"
+                  "/* 数据 */ INSERT INTO t_script VALUES (1);\nSELECT * FROM t_script a JOIN t_other b ON a.id = b.id\n")
+        expected = ("-- 建表\nCREATE TABLE s.t_script (\n  id INT -- 主键\n);\n\n"
+                    "/* 数据 */ INSERT INTO s.t_script VALUES (1);\nSELECT * FROM s.t_script a JOIN s.t_other b ON a.id = b.id\n")
+        self.assertEqual(build_script_rewrite_plan(script).apply("s"), expected)
+        self.assertFalse(script_ends_with_terminator(script))
+        self.assertFalse(script_ends_with_terminator("SELECT 1 -- x;"))
+        self.assertTrue(script_ends_with_terminator("SELECT 1; -- x\n"))
+
+    def test_script_rewrite_falls_back_per_statement(self):
+        # 存储过程需要 LL 预测，整个脚本的 SLL 解析失败后改为逐条分析
+        script = ("UPDATE t_proc_a SET x = 1;\n"
+                  "CREATE PROCEDURE p(OUT total INT) SELECT SUM(x) INTO total FROM t_proc_b;\n"
+                  "DELETE FROM t_proc_c;\n")
+        self.assertEqual(build_script_rewrite_plan(script).apply("s"),
+                         "UPDATE s.t_proc_a SET x = 1;\n"
+                         "CREATE PROCEDURE p(OUT total INT) SELECT SUM(x) INTO total FROM s.t_proc_b;\n"
+                         "DELETE FROM s.t_proc_c;\n")
+        with self.assertRaises(SqlSyntaxError) as cm:
+            build_script_rewrite_plan("DELETE FROM t_proc_c;\n\n  SELECT * FRM t_proc_d;", strict=True)
+        error = cm.exception
+        self.assertEqual((error.statement_index, error.line, error.column), (1, 3, 11))
+
+    def test_grammar_loaded_lazily(self):
+        code = ("import sys, sql_generator, sql_utils; "
+                "assert 'MySqlParser' not in sys.modules and 'MySqlLexer' not in sys.modules; "
+                "print(sql_utils.add_schema_to_sql('DELETE FROM t', 's'))")
+        result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "DELETE FROM s.t")
+
+
+# noinspection SqlNoDataSourceInspection
+class TestParsingContext(unittest.TestCase):
+    """
+    每个线程复用同一组词法/语法分析器，语句之间不能残留状态。直接调用 _analyze_statement，绕过各级缓存。
+    """
+
+    # SLL 预测会失败、需要回退到 LL 的语句
+    LL_STATEMENT = "CREATE PROCEDURE p_ctx(IN p_id INT) SELECT SUM(amount) INTO p_total FROM t_ctx_p WHERE id = p_id"
+
+    def setUp(self):
+        load_grammar()
+        self.context = _parsing_context()
+
+    def test_consecutive_statements(self):
+        self.assertEqual(_analyze_statement("SELECT * FROM t_ctx_a JOIN t_ctx_b ON 1"),
+                         ((14, 20, "t_ctx_a"), (27, 33, "t_ctx_b")))
+        # 上一条语句记录的表名不会带到下一条语句
+        self.assertEqual(_analyze_statement("SELECT * FROM t_ctx_c"), ((14, 20, "t_ctx_c"),))
+        self.assertIs(_parsing_context(), self.context)
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(_parsing_context()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], self.context)
+
+    def test_sll_after_ll_fallback(self):
+        stats = get_parse_stats()
+        fallbacks = stats.ll_fallbacks
+        self.assertEqual([table for _, _, table in _analyze_statement(self.LL_STATEMENT)], ["t_ctx_p"])
+        self.assertEqual(stats.ll_fallbacks, fallbacks + 1)
+
+        replacements = _analyze_statement("SELECT id FROM t_ctx_s WHERE id IN (SELECT id FROM t_ctx_t)")
+        self.assertEqual([table for _, _, table in replacements], ["t_ctx_s", "t_ctx_t"])
+        self.assertEqual(stats.ll_fallbacks, fallbacks + 1)
+
+    def test_strict_and_recover_alternate(self):
+        sql = "SELECT * FROM t_ctx_e WHERE"
+        for _ in range(2):
+            with self.assertRaises(SqlSyntaxError):
+                _analyze_statement(sql, strict=True)
+            self.assertIs(self.context.ll_parser._errHandler, self.context.bail_strategy)
+
+            # 错误恢复模式下不抛出异常，严格模式遗留的错误策略不影响之后的语句
+            self.assertEqual(_analyze_statement(sql), ())
+            self.assertIs(self.context.ll_parser._errHandler, self.context.recovering_strategy)
+            self.assertEqual([table for _, _, table in _analyze_statement(self.LL_STATEMENT)], ["t_ctx_p"])
+
+    def test_no_console_output(self):
+        # 词法规则末尾的 ERROR_RECONGNIGION 匹配任意字符，无法识别的字符不会触发词法错误；
+        # 即便如此，控制台错误监听器也应全部移除
+        for recognizer in (self.context.lexer, self.context.sll_parser, self.context.ll_parser):
+            self.assertEqual(recognizer._listeners, [])
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            _analyze_statement("SELECT \x01 ` FROM t_ctx_q WHERE")
+            _analyze_statement("SELECT * FRM t_ctx_q")
+        self.assertEqual(output.getvalue(), "")
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file